@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # Only active with REQUEST_PROFILING
+    "suivi_operations.profiling.RequestProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "intranet_compta.urls"
@@ -81,6 +84,22 @@ DATABASES = {
     }
 }
 
+# Applied to every new SQLite connection. In WAL mode the readers keep reading
+# the last committed data while an import writes, instead of being locked out.
+# https://www.sqlite.org/pragma.html
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    # Durable at each checkpoint rather than each commit, safe with WAL
+    "synchronous": "normal",
+    # Milliseconds a connection waits for a lock before "database is locked"
+    "busy_timeout": 5000,
+    # Bytes of the database read through memory mapping
+    "mmap_size": 256 * 2**20,
+    # Page cache of each connection, in KiB when negative
+    "cache_size": -32000,
+    "temp_store": "memory",
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -118,6 +137,11 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploaded files, the import jobs keep their file there until they have run
+# https://docs.djangoproject.com/en/4.2/topics/files/
+
+MEDIA_ROOT = BASE_DIR / "media"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -137,3 +161,76 @@ EMAIL_HOST_USER = "user@mail.com"
 EMAIL_HOST_PASSWORD = "pAssWord"
 
 EMAIL_USE_TLS = True
+
+# Debt reminders, queued by the /debt page and sent by the send_reminders worker
+
+# Reminders sent over a same SMTP connection
+DEBT_MAIL_BATCH_SIZE = 100
+
+# Threads rendering the next reminders while the previous ones are sent
+# (0 renders them in the worker itself). Rendering takes about a millisecond
+# by email and holds the GIL, threads only help with a slow relay on several
+# CPUs
+DEBT_MAIL_RENDER_THREADS = 0
+
+# Reminders sent by minute at most, to stay under the limit of the relay
+# (0 for no limit)
+DEBT_MAIL_RATE_LIMIT = 300
+
+# Attempts after which a reminder is failed, and seconds before the first
+# retry (doubled on each attempt)
+DEBT_MAIL_MAX_ATTEMPTS = 5
+DEBT_MAIL_RETRY_DELAY = 60
+
+# Seconds after which a reminder left sending by an interrupted worker is sent
+# again
+DEBT_MAIL_SENDING_TIMEOUT = 600
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The reconciliation pages are versioned by the imports, a local memory or a
+# file based cache both work
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Seconds the reconciliation pages are kept in the cache, the imports make
+# them stale anyway
+RECONCILIATION_CACHE_TIMEOUT = 24 * 3600
+
+# Imports
+
+# Rows committed at once by the import jobs (0 for a single transaction)
+IMPORT_COMMIT_ROWS = 5000
+
+# Seconds without progress after which a running import job is considered
+# interrupted, and resumed by the next run_import_jobs worker
+IMPORT_JOB_TIMEOUT = 600
+
+# Processes parsing the imported rows while the job worker writes them
+# (0 parses in the worker itself)
+IMPORT_PARSE_WORKERS = (os.cpu_count() or 1) - 1
+
+# Import the transactions into a staging table, published to the ledger in a
+# single transaction once the whole file is read and checked
+IMPORT_STAGED_TRANSACTIONS = True
+
+# Share of the profiles with a balance which a staged import may add to the
+# discrepancies before it is refused, when the balances were imported after the
+# previous ledger (None only reports the discrepancies in the job counts)
+IMPORT_MAX_NEW_DISCREPANCIES = None
+
+# Request profiling
+
+# Log the queries and timings of every request, and list the slowest ones on
+# the /profiling staff page
+REQUEST_PROFILING = False
+
+# Requests kept in memory, by process, for the /profiling page
+REQUEST_PROFILING_HISTORY = 200
+
+# Runs of a same query in a request above which it is flagged as N+1 queries
+REQUEST_PROFILING_REPEATED_QUERIES = 5
@@ -4,9 +4,11 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.contrib.auth.models import Group
 from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
-from suivi_operations.models import ProfileAC, User, Transaction
+from suivi_operations.models import ImportJob, ProfileAC, Reminder, User, Transaction
 
 # Inspired by
 # https://docs.djangoproject.com/en/4.2/topics/auth/customizing/
@@ -55,21 +57,79 @@ class UserChangeForm(forms.ModelForm):
         ]
 
 
+class IndexedSearchMixin:
+    """Search a single indexed lookup, chosen from the shape of the term.
+
+    The default search combines contains lookups on every field, which reads
+    whole tables. Here digits look for a contact identifier, terms with an @
+    for the start of an email and other terms for the start of a title.
+    """
+
+    contact_lookup = None
+    email_lookup = None
+    title_lookup = None
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit() and self.contact_lookup:
+            return queryset.filter(**{self.contact_lookup: int(term)}), False
+        if "@" in term or not self.title_lookup:
+            lookup = self.email_lookup
+        else:
+            lookup = self.title_lookup
+        return queryset.filter(**{f"{lookup}__istartswith": term}), False
+
+
 class ProfilAcInline(admin.StackedInline):
     model = ProfileAC
     can_delete = False
     verbose_name = _("AssoConnect profil")
     verbose_name_plural = _("AssoConnect profiles")
+    readonly_fields = ["transactions"]
+
+    @admin.display(description=_("transactions"))
+    def transactions(self, profile):
+        url = reverse("admin:suivi_operations_transaction_changelist")
+        return format_html(
+            '<a href="{}?user__id__exact={}">{}</a>',
+            url,
+            profile.user_id,
+            _("%(count)s transaction(s)") % {"count": profile.transactions_count},
+        )
+
+
+class LatestTransactionFormSet(forms.BaseInlineFormSet):
+    def get_queryset(self):
+        if not hasattr(self, "_queryset"):
+            queryset = super().get_queryset().order_by("-date_event", "-entity_id")
+            self._queryset = queryset[: TransactionInline.max_num]
+        return self._queryset
 
 
 class TransactionInline(admin.TabularInline):
+    """Latest transactions of a user, the others are listed by TransactionAdmin"""
+
     model = Transaction
+    formset = LatestTransactionFormSet
+    verbose_name_plural = _("latest transactions")
+    fields = ["date_event", "provided_title", "amount", "is_deleted"]
+    max_num = 20
     extra = 0
     classes = ["collapse"]
     can_delete = False
+    show_change_link = True
+
+    # Imported lines are edited one by one, from their own page
+    def has_add_permission(self, request, obj=None):
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
 
-class UserAdmin(BaseUserAdmin):
+
+class UserAdmin(IndexedSearchMixin, BaseUserAdmin):
     list_display = [
         "email",
         "first_name",
@@ -80,7 +140,11 @@ class UserAdmin(BaseUserAdmin):
     ]
     ordering = ["last_name", "first_name", "email"]
     list_filter = ["is_active", "is_staff"]
-    search_fields = ["email"]
+    show_full_result_count = False
+    search_fields = ["^email", "^last_name"]
+    search_help_text = _("Beginning of an email address or of a last name.")
+    email_lookup = "email"
+    title_lookup = "last_name"
     filter_horizontal = []
     inlines = [ProfilAcInline, TransactionInline]
 
@@ -123,17 +187,66 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(IndexedSearchMixin, admin.ModelAdmin):
     model = Transaction
-    list_display = ["date_event", "provided_title", "user", "date_event"]
+    list_display = ["date_event", "provided_title", "amount", "user", "is_deleted"]
+    list_select_related = ["user"]
+    list_filter = ["is_deleted"]
+    date_hierarchy = "date_event"
+    raw_id_fields = ["user"]
+    # Counting the whole ledger on each filtered page is useless
+    show_full_result_count = False
+
+    search_fields = ["=user__profile_ac__idContact", "^user__email", "^provided_title"]
+    search_help_text = _(
+        "Contact identifier, or beginning of an email address or of a title."
+    )
+    contact_lookup = "user__profile_ac__idContact"
+    email_lookup = "user__email"
+    title_lookup = "provided_title"
 
 
-class ProfileACAdmin(admin.ModelAdmin):
+class ProfileACAdmin(IndexedSearchMixin, admin.ModelAdmin):
     model = ProfileAC
-    list_display = ["idContact"]
+    list_display = [
+        "idContact",
+        "user",
+        "initial_amount",
+        "current_amount",
+        "transactions_amount",
+        "diff_amount",
+        "member_revo",
+        "member_CS",
+    ]
+    list_select_related = ["user"]
+    list_filter = ["member_revo", "member_CS"]
+    raw_id_fields = ["user"]
+    show_full_result_count = False
+
+    search_fields = ["=idContact", "^user__email"]
+    search_help_text = _("Contact identifier, or beginning of an email address.")
+    contact_lookup = "idContact"
+    email_lookup = "user__email"
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    model = ImportJob
+    list_display = ["created_at", "category", "status", "phase", "rows_processed"]
+    list_filter = ["status", "category"]
+
+
+class ReminderAdmin(admin.ModelAdmin):
+    model = Reminder
+    list_display = ["datetime", "recipient", "balance", "status", "attempts", "sent_at"]
+    list_select_related = ["recipient"]
+    list_filter = ["status"]
+    raw_id_fields = ["recipient"]
+    show_full_result_count = False
 
 
 admin.site.register(User, UserAdmin)
 admin.site.unregister(Group)
 admin.site.register(Transaction, TransactionAdmin)
 admin.site.register(ProfileAC, ProfileACAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
+admin.site.register(Reminder, ReminderAdmin)
@@ -0,0 +1,216 @@
+"""Benchmarks of the imports and the reconciliation views.
+
+Each step goes through the same path as a user: the files are uploaded to
+ImportFileView and imported by run_import_job, then the list and debt mail
+views are requested with the test client, and the queued reminders delivered
+as by the send_reminders worker. The rendering of the reminders is timed
+apart, with the former rendering loop for reference. The run_benchmarks
+command runs them on a throwaway database, with the exports of
+suivi_operations.synthetic.
+"""
+import contextlib
+import re
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.core import mail
+from django.db import connection
+from django.db.models import Prefetch
+from django.template.loader import get_template
+from django.test import Client
+from django.urls import reverse
+
+from .importers import claim_import_job, run_import_job
+from .mailing import DEBT_TEMPLATE, debt_message, deliver_reminders, load_debt_template
+from .models import ImportJob, Reminder, Transaction, User
+
+IMPORT_STEPS = [
+    ("members", ImportJob.Category.MEMBER_LIST),
+    ("transactions", ImportJob.Category.TRANSACTION_LIST),
+    ("balances", ImportJob.Category.BALANCES_LIST),
+]
+
+# Reminders rendered by the rendering benchmark
+RENDERED_REMINDERS = 1000
+
+
+@dataclass
+class Measure:
+    name: str
+    seconds: float
+    queries: int
+    # Peak of the memory allocated by Python during the step, in bytes, when
+    # traced
+    peak_memory: int = None
+    # Rows imported or mails sent, when it applies
+    items: int = None
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries run on a connection"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Benchmark:
+    def __init__(self, paths, trace_memory=False):
+        self.paths = paths
+        # Tracing the allocations slows Python down a lot, the timings of the
+        # two modes can't be compared
+        self.trace_memory = trace_memory
+        self.client = Client()
+        self.measures = []
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """Record the wall time, queries and peak memory of a step.
+
+        Yield the measure so that the step can set its number of items.
+        """
+        measure = Measure(name=name, seconds=0, queries=0)
+        counter = QueryCounter()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                yield measure
+        finally:
+            measure.seconds = time.perf_counter() - start
+            if self.trace_memory:
+                measure.peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            measure.queries = counter.count
+        self.measures.append(measure)
+
+    def request(self, method, url, data=None):
+        response = getattr(self.client, method)(url, data)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method.upper()} {url}: {response.status_code}")
+        return response
+
+    def run(self):
+        for name, category in IMPORT_STEPS:
+            self.run_import(name, category)
+        self.run_user_list()
+        self.run_debt_mail()
+        self.run_reminder_rendering()
+        return self.measures
+
+    def run_import(self, name, category):
+        with self.measure(f"import_upload.{name}"):
+            with open(self.paths[name], "rb") as file:
+                response = self.request(
+                    "post", reverse("import_file"), {"category": category, "file": file}
+                )
+        if response.status_code != 302:
+            raise RuntimeError(f"The {name} file was rejected")
+
+        job = claim_import_job()
+        with self.measure(f"import_job.{name}") as measure:
+            run_import_job(job)
+            measure.items = job.rows_processed
+        if job.status != ImportJob.Status.SUCCEEDED:
+            raise RuntimeError(f"The {name} import failed: {job.error}")
+
+    def run_user_list(self):
+        url = reverse("list_user")
+        for sort in ("diff_amount", "-current_amount", "last_name"):
+            with self.measure(f"user_list.{sort.lstrip('-')}"):
+                response = self.request("get", url, {"sort": sort})
+        with self.measure("user_list.debtors"):
+            self.request("get", url, {"debtors": "on"})
+        # Served by the cache until the next import
+        with self.measure("user_list.cached"):
+            self.request("get", url, {"sort": "last_name"})
+
+        if next_query := response.context["next_query"]:
+            with self.measure("user_list.next_page"):
+                self.request("get", f"{url}?{next_query}")
+
+        with self.measure("user_list.export") as measure:
+            response = self.request(
+                "get", reverse("list_user_export"), {"format": "csv"}
+            )
+            # Without the header line
+            measure.items = sum(1 for line in response.streaming_content) - 1
+
+    def run_debt_mail(self):
+        url = reverse("debt_mail_form")
+        with self.measure("debt_form"):
+            response = self.request("get", url)
+        if next_query := response.context["next_query"]:
+            with self.measure("debt_form.next_page"):
+                self.request("get", f"{url}?{next_query}")
+
+        mail.outbox = []
+        with self.measure("debt_mail") as measure:
+            self.request("post", url, {"all_matching": "on"})
+            measure.items = Reminder.objects.filter(
+                status=Reminder.Status.PENDING
+            ).count()
+        with self.measure("debt_mail.delivery") as measure:
+            for report in deliver_reminders():
+                pass
+            measure.items = len(mail.outbox)
+        mail.outbox = []
+
+        # Everyone was just reminded, only the query is timed
+        with self.measure("reminder_campaign.preview") as measure:
+            response = self.request(
+                "post",
+                reverse("reminder_campaign"),
+                {"min_debt": "0", "min_days": "30", "preview": "on"},
+            )
+            measure.items = response.context["preview"]["count"]
+
+    def run_reminder_rendering(self):
+        """Render the reminders of the first members as before and as now"""
+        users = list(
+            User.objects.select_related("profile_ac")
+            .prefetch_related(
+                Prefetch(
+                    "transactions",
+                    queryset=Transaction.objects.filter(is_deleted=False),
+                )
+            )
+            .order_by("pk")[:RENDERED_REMINDERS]
+        )
+        date_check = datetime.today()
+
+        # The template loaded and the output collapsed for every email
+        with self.measure("reminders.render_per_message") as measure:
+            for user in users:
+                template = get_template(DEBT_TEMPLATE)
+                html_content = template.render({"user": user, "date_check": date_check})
+                re.sub(r"\s*\n\s*", " ", html_content).strip()
+            measure.items = len(users)
+
+        template = load_debt_template()
+        with self.measure("reminders.render") as measure:
+            messages = [debt_message(user, template, date_check) for user in users]
+            measure.items = len(messages)
+
+        # Rendering is CPU bound, the threads only pay off when they overlap
+        # with the waits for the SMTP relay
+        threads = getattr(settings, "DEBT_MAIL_RENDER_THREADS", 0)
+        with self.measure("reminders.render_threads") as measure:
+            with ThreadPoolExecutor(threads or 2) as pool:
+                messages = list(
+                    pool.map(
+                        lambda user: debt_message(user, template, date_check), users
+                    )
+                )
+            measure.items = len(messages)
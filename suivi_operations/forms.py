@@ -1,20 +1,15 @@
-import csv
-import io
-
 from django import forms
 from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 
-from .models import User
+from .models import ImportJob, User
+from .streams import iter_text, read_csv_header
 
 
 class ImportFileForm(forms.Form):
-    class CategoryFile(models.TextChoices):
-        MEMBER_LIST = "Members", _("List of members")
-        TRANSACTION_LIST = "Transactions", _("List of transactions")
-        BALANCES_LIST = "Balances", _("List of initial and current balances")
+    CategoryFile = ImportJob.Category
 
     file = forms.FileField(
         label=_("file to import"),
@@ -30,26 +25,146 @@ class ImportFileForm(forms.Form):
         cleaned_data = super().clean()
 
         if "file" in cleaned_data:
-            file = cleaned_data["file"].read()
+            # Only the beginning of the file is read here, the importers
+            # stream the rest of it
             try:
-                decoded_file = file.decode("utf-8")
+                if (
+                    cleaned_data.get("category")
+                    == ImportFileForm.CategoryFile.MEMBER_LIST
+                ):
+                    if "Email" not in read_csv_header(cleaned_data["file"]):
+                        raise ValidationError(
+                            _('CSV file doesn\'t have an "Email" colomn.')
+                        )
+                else:
+                    next(iter_text(cleaned_data["file"]), None)
             except UnicodeDecodeError:
                 # Could be a validator or extend to more encodings
                 raise ValidationError(_("File must be encode with UTF-8."))
-            else:
-                cleaned_data["file"] = decoded_file
+        return cleaned_data
 
-                if cleaned_data["category"] == ImportFileForm.CategoryFile.MEMBER_LIST:
-                    read_csv = csv.DictReader(io.StringIO(decoded_file))
-                    if "Email" not in read_csv.fieldnames:
-                        raise ValidationError(
-                            _('CSV file doesn\'t have an "Email" colomn.')
-                        )
+
+class DebtorFilterForm(forms.Form):
+    q = forms.CharField(
+        label=_("search"),
+        required=False,
+        help_text=_("Beginning of the email or of the last name."),
+    )
+    min_debt = forms.DecimalField(
+        label=_("owing at least"), required=False, min_value=0, decimal_places=2
+    )
+    max_debt = forms.DecimalField(
+        label=_("owing at most"), required=False, min_value=0, decimal_places=2
+    )
+
+    @staticmethod
+    def debtors():
+        return User.objects.filter(profile_ac__current_amount__lt=0)
+
+    def filter_queryset(self, queryset):
+        """Apply the search and the debt thresholds to a queryset of users"""
+        if not self.is_valid():
+            return queryset
+        if q := self.cleaned_data["q"].strip():
+            queryset = queryset.filter(
+                Q(email__istartswith=q) | Q(last_name__istartswith=q)
+            )
+        # The debts are negative balances
+        if self.cleaned_data["min_debt"] is not None:
+            queryset = queryset.filter(
+                profile_ac__current_amount__lte=-self.cleaned_data["min_debt"]
+            )
+        if self.cleaned_data["max_debt"] is not None:
+            queryset = queryset.filter(
+                profile_ac__current_amount__gte=-self.cleaned_data["max_debt"]
+            )
+        return queryset
+
+
+class SelectDebtUserForm(DebtorFilterForm):
+    """Debtors picked on a page of the list, or all those matching the filters"""
+
+    users = forms.ModelMultipleChoiceField(
+        queryset=DebtorFilterForm.debtors(), required=False
+    )
+    all_matching = forms.BooleanField(
+        label=_("all the debtors matching the filters"), required=False
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The filters are those of the list the debtors were picked from
+        for name in ("q", "min_debt", "max_debt"):
+            self.fields[name].widget = forms.HiddenInput()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get("all_matching") and not cleaned_data.get("users"):
+            raise ValidationError(_("Select at least one debtor."))
         return cleaned_data
 
+    def recipients(self):
+        """Return the selected debtors, resolved by the database for all_matching"""
+        if self.cleaned_data["all_matching"]:
+            return self.filter_queryset(self.debtors())
+        return self.cleaned_data["users"]
 
-class SelectDebtUserForm(forms.Form):
-    debt_user_queryset = User.objects.prefetch_related("profile_ac")
-    debt_user_queryset = debt_user_queryset.filter(profile_ac__current_amount__lt=0)
 
-    users = forms.ModelMultipleChoiceField(queryset=debt_user_queryset)
+class ReminderCampaignForm(forms.Form):
+    min_debt = forms.DecimalField(
+        label=_("owing at least"), initial=10, min_value=0, decimal_places=2
+    )
+    min_days = forms.IntegerField(
+        label=_("days since the last reminder"),
+        initial=30,
+        min_value=0,
+        help_text=_("Debtors reminded more recently are left out."),
+    )
+    exclude_recent_payers = forms.BooleanField(
+        label=_("leave out the debtors who paid since their last reminder"),
+        initial=True,
+        required=False,
+    )
+
+
+class UserListFilterForm(forms.Form):
+    SORT_CHOICES = [
+        ("diff_amount", _("Difference, ascending")),
+        ("-diff_amount", _("Difference, descending")),
+        ("current_amount", _("Current balance, ascending")),
+        ("-current_amount", _("Current balance, descending")),
+        ("last_name", _("Last name, A to Z")),
+        ("-last_name", _("Last name, Z to A")),
+    ]
+
+    sort = forms.ChoiceField(label=_("sort by"), choices=SORT_CHOICES, required=False)
+    discrepancies = forms.BooleanField(label=_("only discrepancies"), required=False)
+    debtors = forms.BooleanField(label=_("only debtors"), required=False)
+    member_revo = forms.BooleanField(label=_("revolution'air members"), required=False)
+    member_CS = forms.BooleanField(
+        label=_("Championnet Sports members"), required=False
+    )
+
+    def filter_queryset(self, queryset):
+        """Apply the selected filters to a queryset of users"""
+        if not self.is_valid():
+            return queryset
+        if self.cleaned_data["discrepancies"]:
+            queryset = queryset.exclude(profile_ac__diff_amount=0)
+        if self.cleaned_data["debtors"]:
+            queryset = queryset.filter(profile_ac__current_amount__lt=0)
+        if self.cleaned_data["member_revo"]:
+            queryset = queryset.filter(profile_ac__member_revo=True)
+        if self.cleaned_data["member_CS"]:
+            queryset = queryset.filter(profile_ac__member_CS=True)
+        return queryset
+
+
+class BalanceAtDateForm(forms.Form):
+    date = forms.DateField(label=_("date"))
+    user = forms.ModelChoiceField(
+        label=_("user"),
+        queryset=User.objects.all(),
+        required=False,
+        help_text=_("The whole club when empty."),
+    )
@@ -0,0 +1,768 @@
+import logging
+import multiprocessing
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Abs, Coalesce
+from django.utils import timezone
+
+from .models import (
+    DataGeneration,
+    ImportJob,
+    MonthlyBalance,
+    ProfileAC,
+    StagedTransaction,
+    Transaction,
+    User,
+)
+from .parsers import parse_amount, parse_day_first_date, parse_month_first_date
+from .resolvers import UserNameResolver
+from .streams import file_fingerprint, iter_batches, iter_csv_rows, iter_json_items
+
+logger = logging.getLogger(__name__)
+
+# Rows written per INSERT/UPDATE statement by the bulk importers
+IMPORT_BATCH_SIZE = 500
+
+
+def parse_batch(parse, rows):
+    """Parse a batch of rows, dropping the skipped ones"""
+    return [record for record in map(parse, rows) if record]
+
+
+class ParseStage:
+    """Parse batches of rows, in a pool of processes when workers are set.
+
+    Batches are submitted ahead of the single writer within a bounded window,
+    so memory stays proportional to the number of workers. Results are
+    yielded in the order of the file.
+    """
+
+    def __init__(self, parse, workers=0):
+        self.parse = parse
+        self.workers = workers
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def map(self, batches):
+        """Yield the number of rows and the parsed records of each batch"""
+        if not self.workers:
+            for batch in batches:
+                yield len(batch), parse_batch(self.parse, batch)
+            return
+
+        if self.executor is None:
+            # Spawned processes don't inherit the database connections
+            self.executor = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+        pending = deque()
+        for batch in batches:
+            future = self.executor.submit(parse_batch, self.parse, batch)
+            pending.append((len(batch), future))
+            if len(pending) > 2 * self.workers:
+                batch_size, future = pending.popleft()
+                yield batch_size, future.result()
+        while pending:
+            batch_size, future = pending.popleft()
+            yield batch_size, future.result()
+
+
+class Importer:
+    """Import the rows of an AssoConnect export batch by batch.
+
+    Subclasses parse each row into a record (or None to skip it), write the
+    records of a batch, and fill ``counts``. A transaction is committed every
+    ``commit_rows`` rows together with the progress callback, which records
+    the checkpoint used to resume an interrupted import.
+    """
+
+    batch_size = IMPORT_BATCH_SIZE
+    phase = "importing"
+
+    def __init__(self, on_progress=None, commit_rows=None, parse_workers=None):
+        self.on_progress = on_progress
+        if commit_rows is None:
+            commit_rows = getattr(settings, "IMPORT_COMMIT_ROWS", 5000)
+        self.commit_rows = commit_rows
+        if parse_workers is None:
+            parse_workers = getattr(settings, "IMPORT_PARSE_WORKERS", 0)
+        self.parse_workers = parse_workers
+        self.rows_processed = 0
+        self.counts = {}
+
+    @staticmethod
+    def parse(row):
+        """Turn a row into a plain record, without database access
+
+        It may run in another process, see ParseStage.
+        """
+        raise NotImplementedError
+
+    def write(self, records):
+        raise NotImplementedError
+
+    def skip(self, row):
+        """Handle a row already committed by an interrupted run"""
+
+    def finish(self):
+        pass
+
+    def notify(self):
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def run(self, rows, start_row=0):
+        rows = iter(rows)
+        for row in islice(rows, start_row):
+            self.skip(row)
+            self.rows_processed += 1
+
+        # Without commit_rows, the whole file is imported in one transaction
+        chunks = iter_batches(rows, self.commit_rows) if self.commit_rows else [rows]
+        with ParseStage(self.parse, self.parse_workers) as parse_stage:
+            for chunk in chunks:
+                with transaction.atomic():
+                    batches = iter_batches(chunk, self.batch_size)
+                    for batch_size, records in parse_stage.map(batches):
+                        self.write(records)
+                        self.rows_processed += batch_size
+                    self.notify()
+
+        with transaction.atomic():
+            self.finish()
+            self.notify()
+        return self.counts
+
+
+class MemberImporter(Importer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counts["members_added"] = 0
+
+    @staticmethod
+    def parse(line):
+        email = line["Email"].strip()
+        try:
+            validate_email(email)
+        except ValidationError:
+            return None
+
+        gender = line.get("Sexe")
+        if gender == "Masculin":
+            gender = User.Gender.MEN
+        elif gender == "Féminin":
+            gender = User.Gender.WOMEN
+        else:
+            gender = User.Gender.UNSPECIFIED
+
+        phone_number = line.get("Téléphone mobile")
+        date_birth = line.get("Date de naissance")
+        id_contact = line.get("ID du Contact")
+        user_values = {
+            "first_name": line.get("Prénom") or "",
+            "last_name": line.get("Nom") or "",
+            "gender": gender,
+            "phone_number": int(phone_number)
+            if phone_number and phone_number.isdigit() and phone_number != "0"
+            else None,
+            "date_of_birth": parse_month_first_date(date_birth)
+            if date_birth and date_birth != "0"
+            else None,
+        }
+        profile_values = {
+            "idContact": int(id_contact)
+            if id_contact and id_contact.isdigit()
+            else None,
+            "member_revo": bool(
+                line.get("Statut adhérent")
+                and re.match("Adhérent", line["Statut adhérent"])
+            ),
+            "member_CS": line.get("Membre annuels (aides CS)") != "",
+            "detail_url": line.get("Détail") or "",
+            "last_check": date.today(),
+        }
+        return email, (user_values, profile_values)
+
+    def write(self, records):
+        # Later lines win, as successive update_or_create calls did
+        members = dict(records)
+
+        existing_users = User.objects.in_bulk(members, field_name="email")
+        self.counts["members_added"] += len(members.keys() - existing_users.keys())
+
+        users = []
+        for email, (user_values, profile_values) in members.items():
+            user = User(email=email, **user_values)
+            if email not in existing_users:
+                user.is_active = False
+            users.append(user)
+        # Bulk operations bypass the post_save signals, profiles are written below
+        User.objects.bulk_create(
+            users,
+            update_conflicts=True,
+            unique_fields=["email"],
+            update_fields=[
+                "first_name",
+                "last_name",
+                "gender",
+                "phone_number",
+                "date_of_birth",
+            ],
+        )
+        user_ids = dict(
+            User.objects.filter(email__in=members).values_list("email", "pk")
+        )
+
+        # Contact identifiers are unique: on conflict, the profile keeps its own
+        id_contacts = {
+            profile_values["idContact"]
+            for user_values, profile_values in members.values()
+            if profile_values["idContact"] is not None
+        }
+        current_contacts = dict(
+            ProfileAC.objects.filter(
+                Q(user_id__in=user_ids.values()) | Q(idContact__in=id_contacts)
+            ).values_list("user_id", "idContact")
+        )
+        contact_owners = {
+            id_contact: user_id
+            for user_id, id_contact in current_contacts.items()
+            if id_contact is not None
+        }
+        for email, user_id in user_ids.items():
+            profile_values = members[email][1]
+            id_contact = profile_values["idContact"]
+            if id_contact is None:
+                continue
+            if contact_owners.setdefault(id_contact, user_id) != user_id:
+                profile_values["idContact"] = current_contacts.get(user_id)
+
+        profiles = [
+            ProfileAC(user_id=user_id, **members[email][1])
+            for email, user_id in user_ids.items()
+        ]
+        ProfileAC.objects.bulk_create(
+            profiles,
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=[
+                "idContact",
+                "member_revo",
+                "member_CS",
+                "detail_url",
+                "last_check",
+            ],
+        )
+
+
+class TransactionImporter(Importer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.resolver = UserNameResolver()
+        self.exported_ids = set()
+        self.counts["transactions_added"] = 0
+
+    @staticmethod
+    def parse(transaction_data):
+        # Every exported line is returned, excluded ones without values, so
+        # that they aren't flagged as deleted
+        entity_id = int(transaction_data["entity_id"])
+        if transaction_data["user_id"] in (
+            "7993922",
+            "8384240",
+            "8845003",
+            "8716849",
+        ):
+            return entity_id, None, None
+
+        if transaction_data["Crédit (EUR)"]:
+            amount = parse_amount(transaction_data["Crédit (EUR)"])
+        elif transaction_data["Débit (EUR)"]:
+            amount = -1 * parse_amount(transaction_data["Débit (EUR)"])
+        else:
+            amount = None
+
+        return (
+            entity_id,
+            transaction_data["user_id"],
+            {
+                "idDocument": transaction_data["Id pièce"],
+                "provided_title": transaction_data["Intitulé"],
+                "amount": amount,
+                "date_event": parse_day_first_date(transaction_data["Date"]),
+            },
+        )
+
+    def skip(self, transaction_data):
+        entity_id, label, values = self.parse(transaction_data)
+        self.exported_ids.add(entity_id)
+        if label is not None:
+            self.resolver.resolve(label)
+
+    def build(self, records):
+        """Return the transactions of the parsed records, by entity_id"""
+        imported_transactions = {}
+        for entity_id, label, values in records:
+            self.exported_ids.add(entity_id)
+            if label is None:
+                continue
+            # Labels are resolved here, the resolver memoizes them
+            user = self.resolver.resolve(label)
+            if user is None:
+                continue
+            transaction = Transaction(entity_id=entity_id, user=user, **values)
+            transaction.fingerprint = transaction.content_fingerprint()
+            imported_transactions[entity_id] = transaction
+        return imported_transactions
+
+    @staticmethod
+    def compare(imported_transactions):
+        """Split the imported transactions into new and modified lines
+
+        Return them with the ids of the users whose balances they change.
+        """
+        # Incremental sync: rows are compared to the stored fingerprints,
+        # only new and modified lines are written.
+        stored_transactions = {
+            entity_id: (fingerprint, is_deleted, user_id)
+            for entity_id, fingerprint, is_deleted, user_id in (
+                Transaction.objects.filter(
+                    entity_id__in=imported_transactions
+                ).values_list("entity_id", "fingerprint", "is_deleted", "user_id")
+            )
+        }
+        new_transactions = []
+        changed_transactions = []
+        touched_user_ids = set()
+        for entity_id, line in imported_transactions.items():
+            if entity_id not in stored_transactions:
+                new_transactions.append(line)
+            elif stored_transactions[entity_id][:2] != (line.fingerprint, False):
+                changed_transactions.append(line)
+                # The line may move from one member to another
+                touched_user_ids.add(stored_transactions[entity_id][2])
+            else:
+                continue
+            touched_user_ids.add(line.user_id)
+        return new_transactions, changed_transactions, touched_user_ids
+
+    @staticmethod
+    def save(new_transactions, changed_transactions):
+        now = timezone.now()
+        for line in changed_transactions:
+            line.last_update = now
+        Transaction.objects.bulk_create(new_transactions)
+        Transaction.objects.bulk_update(
+            changed_transactions,
+            [
+                "user",
+                "idDocument",
+                "provided_title",
+                "amount",
+                "date_event",
+                "is_deleted",
+                "fingerprint",
+                "last_update",
+            ],
+        )
+
+    def write(self, records):
+        new_transactions, changed_transactions, touched_user_ids = self.compare(
+            self.build(records)
+        )
+        self.save(new_transactions, changed_transactions)
+        self.counts["transactions_added"] += len(new_transactions)
+
+        # Stored balances are refreshed in the same transaction as the lines
+        ProfileAC.objects.refresh_transaction_totals(touched_user_ids)
+        MonthlyBalance.objects.refresh(touched_user_ids)
+
+    def deleted_lines(self):
+        """Return the stored lines missing from the export and their users"""
+        stored_ids = Transaction.objects.filter(is_deleted=False).values_list(
+            "entity_id", "user_id"
+        )
+        deleted_ids = []
+        touched_user_ids = set()
+        for entity_id, user_id in stored_ids.iterator():
+            if entity_id not in self.exported_ids:
+                deleted_ids.append(entity_id)
+                touched_user_ids.add(user_id)
+        return deleted_ids, touched_user_ids
+
+    @staticmethod
+    def flag_deleted(deleted_ids):
+        # Lines missing from the export are flagged rather than deleted
+        for start in range(0, len(deleted_ids), IMPORT_BATCH_SIZE):
+            Transaction.objects.filter(
+                entity_id__in=deleted_ids[start : start + IMPORT_BATCH_SIZE]
+            ).update(is_deleted=True, last_update=timezone.now())
+
+    def finish(self):
+        self.phase = "flagging deleted lines"
+        self.notify()
+
+        deleted_ids, touched_user_ids = self.deleted_lines()
+        self.flag_deleted(deleted_ids)
+        ProfileAC.objects.refresh_transaction_totals(touched_user_ids)
+        MonthlyBalance.objects.refresh(touched_user_ids)
+
+        self.counts["unmatched"] = sorted(self.resolver.report.unmatched)
+        self.counts["ambiguous"] = sorted(self.resolver.report.ambiguous)
+
+
+class LedgerValidationError(Exception):
+    """The staged ledger doesn't agree with the imported balances"""
+
+
+class StagedTransactionImporter(TransactionImporter):
+    """Import the transactions into a staging table, then publish them at once
+
+    The lines are staged chunk by chunk, checked against the balances of the
+    profiles, and merged into the ledger in a single short transaction: the
+    readers see the former ledger until the new one is complete. A ledger
+    which would add too many discrepancies between the balances and the
+    transactions, as a truncated export does, is refused.
+    """
+
+    phase = "staging"
+
+    def __init__(self, job, max_new_discrepancies=None, **kwargs):
+        super().__init__(**kwargs)
+        self.job = job
+        if max_new_discrepancies is None:
+            max_new_discrepancies = getattr(
+                settings, "IMPORT_MAX_NEW_DISCREPANCIES", None
+            )
+        self.max_new_discrepancies = max_new_discrepancies
+
+    def staged_transactions(self):
+        return StagedTransaction.objects.filter(job=self.job)
+
+    def write(self, records):
+        staged_transactions = [
+            StagedTransaction(
+                job=self.job,
+                entity_id=entity_id,
+                user_id=line.user_id,
+                idDocument=line.idDocument,
+                provided_title=line.provided_title,
+                amount=line.amount,
+                date_event=line.date_event,
+                fingerprint=line.fingerprint,
+            )
+            for entity_id, line in self.build(records).items()
+        ]
+        # Later lines win, as in the ledger
+        StagedTransaction.objects.bulk_create(
+            staged_transactions,
+            update_conflicts=True,
+            unique_fields=["job", "entity_id"],
+            update_fields=[
+                "user",
+                "idDocument",
+                "provided_title",
+                "amount",
+                "date_event",
+                "fingerprint",
+            ],
+        )
+
+    def finish(self):
+        self.counts["unmatched"] = sorted(self.resolver.report.unmatched)
+        self.counts["ambiguous"] = sorted(self.resolver.report.ambiguous)
+
+    def run(self, rows, start_row=0):
+        if not start_row:
+            # Left by a run on another version of the file
+            self.staged_transactions().delete()
+        super().run(rows, start_row=start_row)
+        self.validate()
+        self.publish()
+        self.staged_transactions().delete()
+        return self.counts
+
+    def validate(self):
+        """Count the profiles whose balance disagrees with the staged ledger
+
+        Raise LedgerValidationError when more than max_new_discrepancies of
+        the profiles with a balance would disagree after the publication, if
+        the balances were imported after the ledger being replaced. Balances
+        imported before describe an older ledger, the new lines of the export
+        are expected to disagree with them.
+        """
+        self.phase = "validating"
+        self.notify()
+
+        zero = Value(Decimal(0))
+        staged_totals = (
+            self.staged_transactions()
+            .filter(user=OuterRef("user"))
+            .values("user")
+            .annotate(total=Sum("amount"))
+            .values("total")
+        )
+        # Cents lost by the floating point arithmetic of SQLite aren't
+        # discrepancies
+        tolerance = Decimal("0.005")
+        discrepancies = (
+            ProfileAC.objects.filter(current_amount__isnull=False)
+            .annotate(
+                gap_before=Abs(
+                    F("current_amount")
+                    - (Coalesce("initial_amount", zero) + F("transactions_amount"))
+                ),
+                gap_after=Abs(
+                    F("current_amount")
+                    - (
+                        Coalesce("initial_amount", zero)
+                        + Coalesce(Subquery(staged_totals), zero)
+                    )
+                ),
+            )
+            .aggregate(
+                profiles=Count("pk"),
+                before=Count("pk", filter=Q(gap_before__gte=tolerance)),
+                after=Count("pk", filter=Q(gap_after__gte=tolerance)),
+            )
+        )
+        self.counts["discrepancies_before"] = discrepancies["before"]
+        self.counts["discrepancies_after"] = discrepancies["after"]
+
+        new_discrepancies = discrepancies["after"] - discrepancies["before"]
+        if (
+            self.max_new_discrepancies is not None
+            and new_discrepancies
+            > self.max_new_discrepancies * discrepancies["profiles"]
+            and self.balances_are_newer()
+        ):
+            raise LedgerValidationError(
+                f"The imported transactions would add {new_discrepancies} "
+                f"discrepancies to the {discrepancies['profiles']} balances"
+            )
+
+    def balances_are_newer(self):
+        """Whether the balances were imported after the ledger being replaced"""
+        last_imports = (
+            ImportJob.objects.filter(status=ImportJob.Status.SUCCEEDED)
+            .exclude(pk=self.job.pk)
+            .aggregate(
+                balances=Max(
+                    "finished_at",
+                    filter=Q(category=ImportJob.Category.BALANCES_LIST),
+                ),
+                transactions=Max(
+                    "finished_at",
+                    filter=Q(category=ImportJob.Category.TRANSACTION_LIST),
+                ),
+            )
+        )
+        if last_imports["balances"] is None:
+            return False
+        return (
+            last_imports["transactions"] is None
+            or last_imports["balances"] > last_imports["transactions"]
+        )
+
+    def publish(self):
+        """Merge the staged lines into the ledger in a single transaction"""
+        self.phase = "publishing"
+        self.notify()
+
+        # The lines to write are found before the transaction, only them are
+        # loaded again while it holds the write lock
+        new_ids = []
+        changed_ids = []
+        touched_user_ids = set()
+        staged_transactions = self.staged_transactions().order_by("entity_id")
+        for batch in iter_batches(
+            staged_transactions.iterator(chunk_size=IMPORT_BATCH_SIZE),
+            IMPORT_BATCH_SIZE,
+        ):
+            new_transactions, changed_transactions, user_ids = self.compare(
+                {staged.entity_id: staged.as_transaction() for staged in batch}
+            )
+            new_ids += [line.entity_id for line in new_transactions]
+            changed_ids += [line.entity_id for line in changed_transactions]
+            touched_user_ids |= user_ids
+        deleted_ids, user_ids = self.deleted_lines()
+        touched_user_ids |= user_ids
+
+        with transaction.atomic():
+            for new_transactions in self.load_staged(new_ids):
+                self.save(new_transactions, [])
+            for changed_transactions in self.load_staged(changed_ids):
+                self.save([], changed_transactions)
+            self.flag_deleted(deleted_ids)
+            ProfileAC.objects.refresh_transaction_totals(touched_user_ids)
+            MonthlyBalance.objects.refresh(touched_user_ids)
+            self.counts["transactions_added"] += len(new_ids)
+            self.notify()
+
+    def load_staged(self, entity_ids):
+        """Yield the staged lines of the given ids as transactions, by batch"""
+        for start in range(0, len(entity_ids), IMPORT_BATCH_SIZE):
+            yield [
+                staged.as_transaction()
+                for staged in self.staged_transactions().filter(
+                    entity_id__in=entity_ids[start : start + IMPORT_BATCH_SIZE]
+                )
+            ]
+
+
+class BalanceImporter(Importer):
+    """Import the balances of the contacts, all written at the end of the file
+
+    The balances file has one line per contact, so it is kept in memory and
+    the profiles are updated with a single bulk_update.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.balances = {}
+        self.counts["balances_updated"] = 0
+
+    @staticmethod
+    def parse(line):
+        id_contact = line.get("ID")
+        if id_contact in (
+            "7993922",
+            "8384240",
+            "8845003",
+            "8716849",
+            "9114357",
+        ):
+            return None
+
+        if id_contact and id_contact.isdigit():
+            return (
+                int(id_contact),
+                (-1) * parse_amount(line.get("Solde en début de période (EUR)")),
+                (-1) * parse_amount(line.get("Solde à la date T (EUR)")),
+            )
+        return None
+
+    def write(self, records):
+        for id_contact, initial_amount, current_amount in records:
+            self.balances[id_contact] = (initial_amount, current_amount)
+
+    def skip(self, line):
+        # Nothing is written before the end of the file
+        if record := self.parse(line):
+            self.write([record])
+
+    def finish(self):
+        profiles = ProfileAC.objects.filter(idContact__in=self.balances).only(
+            "pk", "idContact", "transactions_amount"
+        )
+        updated_profiles = []
+        for profile in profiles:
+            profile.initial_amount, profile.current_amount = self.balances.pop(
+                profile.idContact
+            )
+            profile.update_diff_amount()
+            updated_profiles.append(profile)
+        ProfileAC.objects.bulk_update(
+            updated_profiles,
+            ["initial_amount", "current_amount", "diff_amount"],
+            batch_size=IMPORT_BATCH_SIZE,
+        )
+
+        self.counts["balances_updated"] = len(updated_profiles)
+        # Remaining balances don't match any imported member
+        self.counts["unknown_contacts"] = sorted(self.balances)
+
+
+IMPORTERS = {
+    ImportJob.Category.MEMBER_LIST: (MemberImporter, iter_csv_rows),
+    ImportJob.Category.TRANSACTION_LIST: (TransactionImporter, iter_json_items),
+    ImportJob.Category.BALANCES_LIST: (BalanceImporter, iter_csv_rows),
+}
+
+
+def claim_import_job():
+    """Mark the oldest pending or interrupted job as running and return it"""
+    now = timezone.now()
+    timeout = timedelta(seconds=getattr(settings, "IMPORT_JOB_TIMEOUT", 600))
+    claimable_jobs = ImportJob.objects.filter(
+        Q(status=ImportJob.Status.PENDING)
+        | Q(status=ImportJob.Status.RUNNING, updated_at__lt=now - timeout)
+    )
+    for job in claimable_jobs.order_by("created_at"):
+        # Another worker may have claimed it in the meantime
+        claimed = ImportJob.objects.filter(
+            pk=job.pk, status=job.status, updated_at=job.updated_at
+        ).update(
+            status=ImportJob.Status.RUNNING,
+            phase="starting",
+            started_at=Coalesce("started_at", Value(now)),
+            updated_at=now,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_import_job(job):
+    """Run a claimed import job, resuming from its checkpoint if any"""
+    importer_class, read_rows = IMPORTERS[job.category]
+
+    def on_progress(importer):
+        job.phase = importer.phase
+        job.rows_processed = importer.rows_processed
+        job.counts = importer.counts
+        job.save(update_fields=["phase", "rows_processed", "counts", "updated_at"])
+
+    try:
+        if importer_class is TransactionImporter and getattr(
+            settings, "IMPORT_STAGED_TRANSACTIONS", True
+        ):
+            importer = StagedTransactionImporter(job, on_progress=on_progress)
+        else:
+            importer = importer_class(on_progress=on_progress)
+        with job.file.open("rb"):
+            # The checkpoint only applies to the file it was recorded for
+            fingerprint = file_fingerprint(job.file)
+            if job.file_fingerprint == fingerprint and job.rows_processed:
+                start_row = job.rows_processed
+                importer.counts.update(job.counts)
+            else:
+                start_row = 0
+                job.file_fingerprint = fingerprint
+                job.save(update_fields=["file_fingerprint", "updated_at"])
+            job.counts = importer.run(read_rows(job.file), start_row=start_row)
+    except Exception as error:
+        logger.exception("Import job %s failed", job.pk)
+        job.status = ImportJob.Status.FAILED
+        job.error = str(error)
+        # Failed jobs aren't resumed
+        job.staged_transactions.all().delete()
+    else:
+        job.status = ImportJob.Status.SUCCEEDED
+        job.phase = "done"
+        job.file.delete(save=False)
+    # Failed jobs may have committed some chunks too
+    DataGeneration.objects.bump()
+    job.finished_at = timezone.now()
+    job.save()
+    return job
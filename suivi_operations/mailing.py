@@ -0,0 +1,229 @@
+"""Delivery of the debt reminder emails.
+
+The debt view queues a Reminder for each selected debtor, the send_reminders
+worker delivers them. The reminders are claimed and sent in batches, each
+over a single SMTP connection, so the TLS handshake with the relay happens
+once per batch instead of once per debtor. The worker spaces the messages out
+to stay under the rate limit of the relay, and a failed reminder is retried
+after a delay which doubles on each attempt.
+
+The whitespace of the template layout is collapsed once, when the template is
+loaded, and the messages can be rendered by a pool of threads while the
+previous ones are sent.
+"""
+import contextlib
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Prefetch, Q
+from django.template import engines
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import Reminder, Transaction
+
+logger = logging.getLogger(__name__)
+
+DEBT_TEMPLATE = "suivi_operations/emails/debt_message.html"
+DEBT_SUBJECT = "[important] Revolution'air - Dette à payer"
+
+
+@dataclass
+class BatchReport:
+    number: int
+    # Keys of the messages sent, the reminders for the worker
+    sent: list = field(default_factory=list)
+    # (key, error) of the messages which couldn't be sent
+    failed: list = field(default_factory=list)
+
+
+class RateLimiter:
+    """Space the calls to wait() out to at most rate by minute (0 for no limit)"""
+
+    def __init__(self, rate):
+        self.interval = 60 / rate if rate else 0
+        self.next_time = 0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self.next_time:
+            time.sleep(self.next_time - now)
+            now = self.next_time
+        self.next_time = now + self.interval
+
+
+def load_debt_template():
+    """Load the reminder template, with the line breaks of its layout collapsed.
+
+    The emails are sent on a single line, collapsing the template source once
+    spares a pass over every rendered email. Only the layout is collapsed: the
+    line breaks of the rendered values, as a multi-line transaction title,
+    are kept, where collapsing every email removed them.
+    """
+    source = get_template(DEBT_TEMPLATE).template.source
+    return engines["django"].from_string(re.sub(r"\s*\n\s*", " ", source).strip())
+
+
+def debt_message(user, template, date_check, subject=DEBT_SUBJECT):
+    """Return the reminder email of a user, from the loaded template"""
+    return EmailMessage(
+        subject=subject,
+        from_email="admin@revos.fr",
+        to=[user.email],
+        body=template.render({"user": user, "date_check": date_check}),
+        reply_to=["tresorier@revos.fr"],
+    )
+
+
+def send_batch(report, messages, rate_limiter=None):
+    """Send (key, message) pairs over a single connection, into the report.
+
+    A message refused by the relay, or passed as the exception raised while
+    rendering it, doesn't stop the rest of the batch. The report holds the
+    messages sent so far even when the batch is interrupted.
+    """
+    connection = get_connection()
+    try:
+        connection.open()
+    # The smtplib errors are OSErrors too
+    except OSError as error:
+        report.failed = [(key, str(error)) for key, message in messages]
+    else:
+        try:
+            for key, message in messages:
+                if isinstance(message, Exception):
+                    report.failed.append((key, str(message)))
+                    continue
+                if rate_limiter:
+                    rate_limiter.wait()
+                # Invalid addresses or headers raise ValueErrors
+                try:
+                    connection.send_messages([message])
+                except Exception as error:
+                    report.failed.append((key, str(error)))
+                else:
+                    report.sent.append(key)
+        finally:
+            connection.close()
+
+    logger.log(
+        logging.WARNING if report.failed else logging.INFO,
+        "Debt reminders batch %d: %d sent, %d failed",
+        report.number,
+        len(report.sent),
+        len(report.failed),
+    )
+    return report
+
+
+def claim_reminders(batch_size):
+    """Mark the next due reminders as sending and return them.
+
+    Reminders left sending by an interrupted worker are due again after
+    DEBT_MAIL_SENDING_TIMEOUT seconds.
+    """
+    now = timezone.now()
+    timeout = timedelta(seconds=getattr(settings, "DEBT_MAIL_SENDING_TIMEOUT", 600))
+    due = Q(status=Reminder.Status.PENDING, next_attempt_at__lte=now) | Q(
+        status=Reminder.Status.SENDING, updated_at__lt=now - timeout
+    )
+    pks = list(
+        Reminder.objects.filter(due)
+        .order_by("next_attempt_at")
+        .values_list("pk", flat=True)[:batch_size]
+    )
+    if not pks:
+        return []
+    # Another worker may have claimed some of them in the meantime, the claim
+    # date tells ours apart
+    Reminder.objects.filter(due, pk__in=pks).update(
+        status=Reminder.Status.SENDING, updated_at=now
+    )
+    return list(
+        Reminder.objects.filter(
+            pk__in=pks, status=Reminder.Status.SENDING, updated_at=now
+        )
+        .select_related("recipient__profile_ac")
+        .prefetch_related(
+            Prefetch(
+                "recipient__transactions",
+                queryset=Transaction.objects.filter(is_deleted=False),
+            )
+        )
+        .order_by("next_attempt_at")
+    )
+
+
+def record_batch(report):
+    """Save the outcome of a batch of reminders, scheduling the retries"""
+    now = timezone.now()
+    max_attempts = getattr(settings, "DEBT_MAIL_MAX_ATTEMPTS", 5)
+    retry_delay = getattr(settings, "DEBT_MAIL_RETRY_DELAY", 60)
+
+    Reminder.objects.filter(pk__in=[reminder.pk for reminder in report.sent]).update(
+        status=Reminder.Status.SENT, sent_at=now, error="", updated_at=now
+    )
+
+    failed = []
+    for reminder, error in report.failed:
+        reminder.attempts += 1
+        reminder.error = error
+        reminder.updated_at = now
+        if reminder.attempts >= max_attempts:
+            reminder.status = Reminder.Status.FAILED
+        else:
+            reminder.status = Reminder.Status.PENDING
+            delay = retry_delay * 2 ** (reminder.attempts - 1)
+            reminder.next_attempt_at = now + timedelta(seconds=delay)
+        failed.append(reminder)
+        logger.warning(
+            "Debt reminder %s to %s failed (attempt %d): %s",
+            reminder.pk,
+            reminder.recipient.email,
+            reminder.attempts,
+            error,
+        )
+    Reminder.objects.bulk_update(
+        failed, ["status", "attempts", "next_attempt_at", "error", "updated_at"]
+    )
+
+
+def deliver_reminders(batch_size=None, rate_limiter=None, template=None):
+    """Send the due reminders batch by batch, yield the report of each batch"""
+    batch_size = batch_size or getattr(settings, "DEBT_MAIL_BATCH_SIZE", 100)
+    threads = getattr(settings, "DEBT_MAIL_RENDER_THREADS", 0)
+    template = template or load_debt_template()
+
+    def render(reminder):
+        # The recipients and their transactions are already fetched, the
+        # threads don't query the database
+        try:
+            message = debt_message(
+                reminder.recipient, template, reminder.datetime, reminder.subject
+            )
+        except Exception as error:
+            logger.exception("Debt reminder %s couldn't be rendered", reminder.pk)
+            return reminder, error
+        return reminder, message
+
+    with ThreadPoolExecutor(threads) if threads else contextlib.nullcontext() as pool:
+        number = 0
+        while reminders := claim_reminders(batch_size):
+            number += 1
+            # Rendered lazily, the pool renders the next messages of the batch
+            # while the connection waits for the relay
+            messages = pool.map(render, reminders) if pool else map(render, reminders)
+            report = BatchReport(number)
+            try:
+                send_batch(report, messages, rate_limiter)
+            finally:
+                # The reminders left out are claimed again after the timeout,
+                # the ones sent must not be
+                record_batch(report)
+            yield report
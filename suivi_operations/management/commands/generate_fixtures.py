@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from suivi_operations.synthetic import write_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Write synthetic AssoConnect exports (members, transactions and "
+        "balances), to try the imports at scale."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            nargs="+",
+            default=[1000],
+            help="Number of members of each synthetic club (1000, 10000, 100000).",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the synthetic exports."
+        )
+        parser.add_argument(
+            "--output", default="fixtures", help="Directory where to write the files."
+        )
+
+    def handle(self, *args, size, seed, output, **options):
+        for members in size:
+            for path in write_export(output, members, seed=seed).values():
+                self.stdout.write(str(path))
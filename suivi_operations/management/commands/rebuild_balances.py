@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from suivi_operations.models import DataGeneration, MonthlyBalance, ProfileAC
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the transaction totals stored on every AssoConnect profile and "
+        "the monthly balances, for instance after editing the ledger outside of "
+        "the imports."
+    )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        count = ProfileAC.objects.refresh_transaction_totals()
+        months = MonthlyBalance.objects.refresh()
+        DataGeneration.objects.bump()
+        self.stdout.write(
+            f"{count} profile(s) and {months} monthly balance(s) refreshed"
+        )
@@ -0,0 +1,108 @@
+import contextlib
+import json
+import os
+import platform
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.utils import timezone
+
+from suivi_operations.benchmarks import Benchmark
+from suivi_operations.synthetic import write_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the imports and the reconciliation views on synthetic AssoConnect "
+        "exports, in a throwaway database, and write the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=1000,
+            help="Number of members of the synthetic club (1000, 10000, 100000).",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the synthetic exports."
+        )
+        parser.add_argument(
+            "--trace-memory",
+            action="store_true",
+            help="Record the peak memory of each step, timings are much slower.",
+        )
+        parser.add_argument(
+            "--output",
+            help="JSON file where to write the results, benchmark-SIZE.json "
+            "by default.",
+        )
+        parser.add_argument(
+            "--compare",
+            help="JSON results of a previous run, to show the time ratios.",
+        )
+
+    def handle(self, *args, size, seed, trace_memory, output, compare, **options):
+        previous = {}
+        if compare:
+            with open(compare, encoding="utf-8") as file:
+                previous = {
+                    measure["name"]: measure for measure in json.load(file)["measures"]
+                }
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.stdout.write(f"Generating the exports of {size} members")
+            paths = write_export(directory, size, seed=seed)
+            with self.test_database(directory), override_settings(MEDIA_ROOT=directory):
+                measures = Benchmark(paths, trace_memory=trace_memory).run()
+
+        results = {
+            "size": size,
+            "seed": seed,
+            "date": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "trace_memory": trace_memory,
+            "measures": [measure.as_dict() for measure in measures],
+        }
+        output = output or f"benchmark-{size}.json"
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+        for measure in measures:
+            line = (
+                f"{measure.name:<28} {measure.seconds:9.3f} s "
+                f"{measure.queries:7} queries"
+            )
+            if measure.peak_memory is not None:
+                line += f" {measure.peak_memory / 2**20:8.1f} MiB"
+            if measure.name in previous:
+                line += f"  x{measure.seconds / previous[measure.name]['seconds']:.2f}"
+            self.stdout.write(line)
+        self.stdout.write(f"Results written to {output}")
+
+    @contextlib.contextmanager
+    def test_database(self, directory):
+        """Create a test database, with the locmem mail backend of the tests"""
+        setup_test_environment()
+        if connection.vendor == "sqlite":
+            # The default SQLite test database is in memory, unlike production
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                directory, "benchmark.sqlite3"
+            )
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from suivi_operations.importers import claim_import_job, run_import_job
+
+
+class Command(BaseCommand):
+    help = "Run the queued import jobs, polling the database for new ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Stop as soon as no job is pending.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds to wait between two polls.",
+        )
+
+    def handle(self, *args, once=False, interval=2, **options):
+        while True:
+            job = claim_import_job()
+            if job is None:
+                if once:
+                    return
+                time.sleep(interval)
+                continue
+
+            self.stdout.write(f"Import job {job.pk}: {job.get_category_display()}")
+            run_import_job(job)
+            self.stdout.write(f"Import job {job.pk}: {job.summary}")
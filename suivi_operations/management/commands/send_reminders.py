@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from suivi_operations.mailing import RateLimiter, deliver_reminders
+
+
+class Command(BaseCommand):
+    help = "Send the queued debt reminders, polling the database for new ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Stop as soon as no reminder is due.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds to wait between two polls.",
+        )
+
+    def handle(self, *args, once=False, interval=10, **options):
+        # Shared by the batches, the limit holds across polls
+        rate_limiter = RateLimiter(getattr(settings, "DEBT_MAIL_RATE_LIMIT", 0))
+        while True:
+            for report in deliver_reminders(rate_limiter=rate_limiter):
+                self.stdout.write(
+                    f"Batch {report.number}: {len(report.sent)} sent, "
+                    f"{len(report.failed)} failed"
+                )
+            if once:
+                return
+            time.sleep(interval)
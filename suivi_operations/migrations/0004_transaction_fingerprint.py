@@ -0,0 +1,97 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:48
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def compute_fingerprints(apps, schema_editor):
+    """Fingerprint the stored lines, as Transaction.content_fingerprint does
+
+    Without them, the first import would rewrite the whole ledger.
+    """
+    Transaction = apps.get_model("suivi_operations", "Transaction")
+    transactions = Transaction.objects.only(
+        "pk", "user_id", "idDocument", "provided_title", "amount", "date_event"
+    ).order_by("pk")
+    batch = []
+    for transaction in transactions.iterator(chunk_size=500):
+        content = "|".join(
+            str(value)
+            for value in (
+                transaction.user_id,
+                transaction.idDocument,
+                transaction.provided_title,
+                transaction.amount,
+                transaction.date_event,
+            )
+        )
+        transaction.fingerprint = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        batch.append(transaction)
+        if len(batch) == 500:
+            Transaction.objects.bulk_update(batch, ["fingerprint"])
+            batch = []
+    Transaction.objects.bulk_update(batch, ["fingerprint"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "suivi_operations",
+            "0003_profileac_current_amount_profileac_initial_amount_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="fingerprint",
+            field=models.CharField(
+                blank=True,
+                help_text="Hash of the imported values, used to skip unchanged lines.",
+                max_length=40,
+                verbose_name="content fingerprint",
+            ),
+        ),
+        migrations.RunPython(
+            compute_fingerprints, reverse_code=migrations.RunPython.noop
+        ),
+        migrations.AlterField(
+            model_name="profileac",
+            name="current_amount",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                max_digits=7,
+                null=True,
+                verbose_name="current balance",
+            ),
+        ),
+        migrations.CreateModel(
+            name="Reminder",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("datetime", models.DateTimeField(default="")),
+                ("subject", models.CharField(max_length=300)),
+                ("balance", models.DecimalField(decimal_places=2, max_digits=7)),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reminders",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0004_transaction_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "category",
+                    models.CharField(
+                        choices=[
+                            ("Members", "List of members"),
+                            ("Transactions", "List of transactions"),
+                            ("Balances", "List of initial and current balances"),
+                        ],
+                        max_length=20,
+                        verbose_name="file category",
+                    ),
+                ),
+                (
+                    "file",
+                    models.FileField(
+                        upload_to="imports/", verbose_name="imported file"
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("succeeded", "Succeeded"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                        verbose_name="status",
+                    ),
+                ),
+                (
+                    "phase",
+                    models.CharField(
+                        default="queued", max_length=50, verbose_name="phase"
+                    ),
+                ),
+                (
+                    "rows_processed",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="rows processed"
+                    ),
+                ),
+                (
+                    "counts",
+                    models.JSONField(blank=True, default=dict, verbose_name="counts"),
+                ),
+                ("error", models.TextField(blank=True, verbose_name="error")),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="creation date"
+                    ),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="start date"
+                    ),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="end date"
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0005_importjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="file_fingerprint",
+            field=models.CharField(
+                blank=True, max_length=64, verbose_name="file fingerprint"
+            ),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, verbose_name="last update"),
+        ),
+        migrations.AlterField(
+            model_name="importjob",
+            name="rows_processed",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Rows committed so far, an interrupted import resumes after them.",
+                verbose_name="rows processed",
+            ),
+        ),
+    ]
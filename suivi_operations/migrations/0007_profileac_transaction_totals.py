@@ -0,0 +1,49 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:57
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def compute_transaction_totals(apps, schema_editor):
+    ProfileAC = apps.get_model("suivi_operations", "ProfileAC")
+    Transaction = apps.get_model("suivi_operations", "Transaction")
+    totals = (
+        Transaction.objects.filter(is_deleted=False)
+        .values("user_id")
+        .annotate(amount=Sum("amount"), count=Count("pk"))
+    )
+    for total in totals:
+        ProfileAC.objects.filter(user_id=total["user_id"]).update(
+            transactions_amount=total["amount"],
+            transactions_count=total["count"],
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0006_importjob_checkpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profileac",
+            name="transactions_amount",
+            field=models.DecimalField(
+                decimal_places=2,
+                default=0,
+                help_text="Sum of the non deleted transactions, kept up to date on import.",
+                max_digits=9,
+                verbose_name="transactions total",
+            ),
+        ),
+        migrations.AddField(
+            model_name="profileac",
+            name="transactions_count",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="number of transactions"
+            ),
+        ),
+        migrations.RunPython(
+            compute_transaction_totals, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+def compute_diff_amounts(apps, schema_editor):
+    """Compute the differences in Python, as ProfileAC.update_diff_amount does
+
+    The SQLite arithmetic is done on floats, reconciled profiles would get a
+    tiny difference instead of 0.
+    """
+    ProfileAC = apps.get_model("suivi_operations", "ProfileAC")
+    profiles = ProfileAC.objects.filter(current_amount__isnull=False).only(
+        "pk", "initial_amount", "current_amount", "transactions_amount"
+    )
+    updated_profiles = []
+    for profile in profiles.iterator(chunk_size=500):
+        profile.diff_amount = profile.current_amount - (
+            (profile.initial_amount or 0) + profile.transactions_amount
+        )
+        updated_profiles.append(profile)
+    ProfileAC.objects.bulk_update(updated_profiles, ["diff_amount"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0007_profileac_transaction_totals"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profileac",
+            name="diff_amount",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                help_text="Imported current balance minus the calculated one.",
+                max_digits=9,
+                null=True,
+                verbose_name="balance difference",
+            ),
+        ),
+        migrations.RunPython(
+            compute_diff_amounts, reverse_code=migrations.RunPython.noop
+        ),
+        migrations.AddIndex(
+            model_name="profileac",
+            index=models.Index(
+                fields=["diff_amount", "user"], name="profileac_diff_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="profileac",
+            index=models.Index(
+                fields=["current_amount", "user"], name="profileac_current_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(fields=["last_name", "id"], name="user_last_name_idx"),
+        ),
+    ]
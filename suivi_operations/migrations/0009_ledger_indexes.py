@@ -0,0 +1,38 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0008_reconciliation_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["user", "is_deleted", "amount"], name="transaction_user_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False)),
+                fields=["date_event", "amount"],
+                name="transaction_date_idx",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="transactions",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
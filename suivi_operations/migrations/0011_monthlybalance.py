@@ -0,0 +1,104 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def compute_monthly_balances(apps, schema_editor):
+    MonthlyBalance = apps.get_model("suivi_operations", "MonthlyBalance")
+    Transaction = apps.get_model("suivi_operations", "Transaction")
+    months = (
+        Transaction.objects.filter(is_deleted=False)
+        .annotate(month=TruncMonth("date_event"))
+        .values("user_id", "month")
+        .annotate(amount=Sum("amount"), count=Count("pk"))
+        .order_by("user_id", "month")
+    )
+    monthly_balances = []
+    user_id = None
+    for month in months:
+        if month["user_id"] != user_id:
+            user_id = month["user_id"]
+            balance = 0
+        balance += month["amount"]
+        monthly_balances.append(MonthlyBalance(balance=balance, **month))
+    MonthlyBalance.objects.bulk_create(monthly_balances, batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0010_datageneration"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "month",
+                    models.DateField(
+                        help_text="First day of the month.", verbose_name="month"
+                    ),
+                ),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=9, verbose_name="amount"
+                    ),
+                ),
+                (
+                    "count",
+                    models.PositiveIntegerField(verbose_name="number of transactions"),
+                ),
+                (
+                    "balance",
+                    models.DecimalField(
+                        decimal_places=2,
+                        help_text="Sum of the transactions up to the end of the month.",
+                        max_digits=9,
+                        verbose_name="balance",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="monthly_balances",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["month", "amount"], name="monthlybalance_month_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="monthlybalance",
+            constraint=models.UniqueConstraint(
+                fields=("user", "month"), name="monthlybalance_user_month_unique"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="profileac",
+            index=models.Index(fields=["initial_amount"], name="profileac_initial_idx"),
+        ),
+        migrations.RunPython(
+            compute_monthly_balances, reverse_code=migrations.RunPython.noop
+        ),
+    ]
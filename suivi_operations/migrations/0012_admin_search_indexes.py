@@ -0,0 +1,40 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:18
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0011_monthlybalance"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="transaction",
+            name="transaction_date_idx",
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["date_event", "is_deleted", "amount"],
+                name="transaction_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate(
+                    "provided_title", "nocase"
+                ),
+                name="transaction_title_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("email", "nocase"),
+                name="user_email_nocase_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:22
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0012_admin_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="reminder",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0, verbose_name="attempts"),
+        ),
+        migrations.AddField(
+            model_name="reminder",
+            name="error",
+            field=models.TextField(blank=True, verbose_name="error"),
+        ),
+        migrations.AddField(
+            model_name="reminder",
+            name="next_attempt_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                help_text="A failed reminder is retried after a growing delay.",
+                verbose_name="next attempt",
+            ),
+        ),
+        migrations.AddField(
+            model_name="reminder",
+            name="sent_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="sending date"
+            ),
+        ),
+        migrations.AddField(
+            model_name="reminder",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("sending", "Sending"),
+                    ("sent", "Sent"),
+                    ("failed", "Failed"),
+                ],
+                default="pending",
+                max_length=10,
+                verbose_name="status",
+            ),
+        ),
+        migrations.AddField(
+            model_name="reminder",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, verbose_name="last update"),
+        ),
+        migrations.AlterField(
+            model_name="reminder",
+            name="datetime",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="reminder",
+            index=models.Index(
+                fields=["status", "next_attempt_at"], name="reminder_due_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0013_reminder_outbox"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="reminder",
+            name="recipient",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="reminders",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reminder",
+            index=models.Index(
+                fields=["recipient", "datetime"], name="reminder_recipient_idx"
+            ),
+        ),
+    ]
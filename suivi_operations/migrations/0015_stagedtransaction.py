@@ -0,0 +1,66 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0014_reminder_recipient_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StagedTransaction",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("entity_id", models.PositiveIntegerField()),
+                ("idDocument", models.PositiveIntegerField()),
+                ("provided_title", models.CharField(max_length=300)),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=7)),
+                ("date_event", models.DateField()),
+                ("fingerprint", models.CharField(max_length=40)),
+                (
+                    "job",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="staged_transactions",
+                        to="suivi_operations.importjob",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["job", "user", "amount"],
+                        name="stagedtransaction_user_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="stagedtransaction",
+            constraint=models.UniqueConstraint(
+                fields=("job", "entity_id"), name="stagedtransaction_job_unique"
+            ),
+        ),
+    ]
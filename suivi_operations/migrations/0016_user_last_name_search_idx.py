@@ -0,0 +1,20 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:12
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("suivi_operations", "0015_stagedtransaction"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("last_name", "nocase"),
+                name="user_last_name_nocase_idx",
+            ),
+        ),
+    ]
@@ -1,10 +1,17 @@
-from datetime import date
+import hashlib
+from datetime import date, timedelta
+from decimal import Decimal
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.db import models
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Collate, TruncDate, TruncMonth
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .parsers import TWO_PLACES
+
 
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None):
@@ -74,6 +81,14 @@ class User(AbstractBaseUser):
     class Meta:
         verbose_name = _("user")
         verbose_name_plural = _("users")
+        indexes = [
+            models.Index(fields=["last_name", "id"], name="user_last_name_idx"),
+            # Case insensitive prefix search of the admin, SQLite collation
+            models.Index(Collate("email", "nocase"), name="user_email_nocase_idx"),
+            models.Index(
+                Collate("last_name", "nocase"), name="user_last_name_nocase_idx"
+            ),
+        ]
 
     def __str__(self):
         if self.first_name and self.last_name:
@@ -100,6 +115,37 @@ class User(AbstractBaseUser):
     #     send_mail(subject, message, from_email, [self.email], **kwargs)
 
 
+class ProfileACManager(models.Manager):
+    def refresh_transaction_totals(self, user_ids=None):
+        """Recompute the stored transaction totals of the given users, or all"""
+        profiles = self.only("pk", "user_id", "initial_amount", "current_amount")
+        transactions = Transaction.objects.filter(is_deleted=False)
+        if user_ids is not None:
+            profiles = profiles.filter(user_id__in=user_ids)
+            transactions = transactions.filter(user_id__in=user_ids)
+
+        totals = {
+            user_id: (amount, count)
+            for user_id, amount, count in transactions.values("user_id")
+            .annotate(amount=Sum("amount"), count=Count("pk"))
+            .values_list("user_id", "amount", "count")
+        }
+        updated_profiles = []
+        for profile in profiles:
+            (
+                profile.transactions_amount,
+                profile.transactions_count,
+            ) = totals.get(profile.user_id, (0, 0))
+            profile.update_diff_amount()
+            updated_profiles.append(profile)
+        self.bulk_update(
+            updated_profiles,
+            ["transactions_amount", "transactions_count", "diff_amount"],
+            batch_size=500,
+        )
+        return len(updated_profiles)
+
+
 class ProfileAC(models.Model):
     """Profile contenant les informations AssoConnect des contacts"""
 
@@ -129,6 +175,89 @@ class ProfileAC(models.Model):
     member_CS = models.BooleanField(_("Championnet Sports membership"), default=False)
     detail_url = models.URLField(_("detail url"), blank=True)
     last_check = models.DateField(_("last check"), default=date.today)
+    transactions_amount = models.DecimalField(
+        _("transactions total"),
+        max_digits=9,
+        decimal_places=2,
+        default=0,
+        help_text=_("Sum of the non deleted transactions, kept up to date on import."),
+    )
+    transactions_count = models.PositiveIntegerField(
+        _("number of transactions"), default=0
+    )
+    diff_amount = models.DecimalField(
+        _("balance difference"),
+        max_digits=9,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text=_("Imported current balance minus the calculated one."),
+    )
+
+    objects = ProfileACManager()
+
+    # Imported fields shown by the cached pages, a change of one of them
+    # makes the pages stale
+    imported_fields = (
+        "idContact",
+        "initial_amount",
+        "current_amount",
+        "member_revo",
+        "member_CS",
+        "transactions_amount",
+        "transactions_count",
+        "diff_amount",
+    )
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the reconciliation list
+            models.Index(fields=["diff_amount", "user"], name="profileac_diff_idx"),
+            models.Index(
+                fields=["current_amount", "user"], name="profileac_current_idx"
+            ),
+            # Sum of the initial balances, for the club balance at a date
+            models.Index(fields=["initial_amount"], name="profileac_initial_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        profile = super().from_db(db, field_names, values)
+        profile._loaded_values = dict(zip(field_names, values))
+        return profile
+
+    def save(self, *args, **kwargs):
+        self.update_diff_amount()
+        super().save(*args, **kwargs)
+        deferred_fields = self.get_deferred_fields()
+        self._loaded_values = {
+            field: getattr(self, field)
+            for field in self.imported_fields
+            if field not in deferred_fields
+        }
+
+    def imported_fields_changed(self):
+        """Whether the last save changed an imported field, or created it"""
+        loaded_values = getattr(self, "_loaded_values", None)
+        if loaded_values is None:
+            return True
+        return any(
+            getattr(self, field) != loaded_values[field]
+            for field in self.imported_fields
+            if field in loaded_values
+        )
+
+    def update_diff_amount(self):
+        """Compare the imported balance to the initial one plus the transactions
+
+        Bulk updates of the amounts must call it, and include diff_amount.
+        """
+        if self.current_amount is None:
+            self.diff_amount = None
+        else:
+            self.diff_amount = self.current_amount - (
+                (self.initial_amount or 0) + self.transactions_amount
+            )
 
 
 class Transaction(models.Model):
@@ -137,6 +266,8 @@ class Transaction(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.PROTECT,
         related_name="transactions",
+        # Covered by the transaction_user_idx index
+        db_index=False,
     )
     idDocument = models.PositiveIntegerField(_("document identifier"), unique=False)
     provided_title = models.CharField(_("provided title"), max_length=300)
@@ -154,6 +285,52 @@ class Transaction(models.Model):
     last_update = models.DateTimeField(_("last check"), auto_now=True)
     imported_date = models.DateTimeField(_("date of first import"), auto_now_add=True)
     is_deleted = models.BooleanField(_("state of deletion"), default=False)
+    fingerprint = models.CharField(
+        _("content fingerprint"),
+        max_length=40,
+        blank=True,
+        help_text=_("Hash of the imported values, used to skip unchanged lines."),
+    )
+
+    class Meta:
+        indexes = [
+            # Per user totals and ledgers, without reading the deleted lines
+            models.Index(
+                fields=["user", "is_deleted", "amount"], name="transaction_user_idx"
+            ),
+            # Date ranges, over the current ledger or the whole of it as the
+            # date hierarchy of the admin does
+            models.Index(
+                fields=["date_event", "is_deleted", "amount"],
+                name="transaction_date_idx",
+            ),
+            # Case insensitive prefix search of the admin, SQLite collation
+            models.Index(
+                Collate("provided_title", "nocase"), name="transaction_title_idx"
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The imports write with bulk operations, any other edit makes the line
+        # differ from the export: the next import must rewrite it
+        self.fingerprint = ""
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "fingerprint"}
+        super().save(*args, **kwargs)
+
+    def content_fingerprint(self):
+        content = "|".join(
+            str(value)
+            for value in (
+                self.user_id,
+                self.idDocument,
+                self.provided_title,
+                self.amount,
+                self.date_event,
+            )
+        )
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
 
     @property
     def verbose_title(self):
@@ -165,16 +342,394 @@ class Transaction(models.Model):
         return self.provided_title
 
 
+class MonthlyBalanceManager(models.Manager):
+    def refresh(self, user_ids=None):
+        """Recompute the monthly balances of the given users, or all"""
+        transactions = Transaction.objects.filter(is_deleted=False)
+        balances = self.all()
+        if user_ids is not None:
+            transactions = transactions.filter(user_id__in=user_ids)
+            balances = balances.filter(user_id__in=user_ids)
+
+        months = (
+            transactions.annotate(month=TruncMonth("date_event"))
+            .values("user_id", "month")
+            .annotate(amount=Sum("amount"), count=Count("pk"))
+            .order_by("user_id", "month")
+        )
+        monthly_balances = []
+        user_id = None
+        for month in months:
+            if month["user_id"] != user_id:
+                user_id = month["user_id"]
+                balance = 0
+            balance += month["amount"]
+            monthly_balances.append(MonthlyBalance(balance=balance, **month))
+
+        balances.delete()
+        self.bulk_create(monthly_balances, batch_size=500)
+        return len(monthly_balances)
+
+    def balance_at(self, day, user_id=None):
+        """Balance at the end of a day, of a user or of the whole club.
+
+        The months before are read from the snapshots, only the lines of the
+        month of the day are summed from the ledger.
+        """
+        month = day.replace(day=1)
+        transactions = Transaction.objects.filter(
+            is_deleted=False, date_event__gte=month, date_event__lte=day
+        )
+        profiles = ProfileAC.objects.all()
+        if user_id is None:
+            snapshot = self.filter(month__lt=month).aggregate(total=Sum("amount"))
+            snapshot = snapshot["total"]
+        else:
+            transactions = transactions.filter(user_id=user_id)
+            profiles = profiles.filter(user_id=user_id)
+            snapshot = (
+                self.filter(user_id=user_id, month__lt=month)
+                .order_by("-month")
+                .values_list("balance", flat=True)
+                .first()
+            )
+        initial_amount = profiles.aggregate(total=Sum("initial_amount"))["total"]
+        delta = transactions.aggregate(total=Sum("amount"))["total"]
+        # The sums computed by the database come without their trailing zeros
+        balance = (initial_amount or 0) + (snapshot or 0) + (delta or 0)
+        return Decimal(balance).quantize(TWO_PLACES)
+
+    def history(self, user_id=None):
+        """Monthly amounts and end of month balances, of a user or of the club"""
+        balances = self.all()
+        profiles = ProfileAC.objects.all()
+        if user_id is not None:
+            balances = balances.filter(user_id=user_id)
+            profiles = profiles.filter(user_id=user_id)
+        months = (
+            balances.values("month")
+            .annotate(amount=Sum("amount"), count=Sum("count"))
+            .order_by("month")
+        )
+        balance = profiles.aggregate(total=Sum("initial_amount"))["total"] or 0
+        history = []
+        for month in months:
+            amount = month["amount"].quantize(TWO_PLACES)
+            balance = (balance + amount).quantize(TWO_PLACES)
+            history.append({**month, "amount": amount, "balance": balance})
+        return history
+
+
+class MonthlyBalance(models.Model):
+    """Transactions of a user summed by month, refreshed by the imports"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="monthly_balances",
+    )
+    month = models.DateField(_("month"), help_text=_("First day of the month."))
+    amount = models.DecimalField(_("amount"), max_digits=9, decimal_places=2)
+    count = models.PositiveIntegerField(_("number of transactions"))
+    balance = models.DecimalField(
+        _("balance"),
+        max_digits=9,
+        decimal_places=2,
+        help_text=_("Sum of the transactions up to the end of the month."),
+    )
+
+    objects = MonthlyBalanceManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "month"], name="monthlybalance_user_month_unique"
+            ),
+        ]
+        indexes = [
+            # Club balance at a date
+            models.Index(fields=["month", "amount"], name="monthlybalance_month_idx"),
+        ]
+
+
+class ReminderManager(models.Manager):
+    def queue(self, recipients, subject, now=None):
+        """Queue a reminder for each user of a queryset, with their balance.
+
+        The users whose previous reminder isn't sent yet are skipped, the
+        recipients are read in one query. Return the numbers of queued and
+        skipped users.
+        """
+        now = now or timezone.now()
+        already_queued = Exists(
+            self.filter(
+                recipient=OuterRef("pk"),
+                status__in=[Reminder.Status.PENDING, Reminder.Status.SENDING],
+            )
+        )
+        recipients = recipients.annotate(already_queued=already_queued)
+        reminders = []
+        skipped = 0
+        for user_id, balance, skip in recipients.values_list(
+            "pk", "profile_ac__current_amount", "already_queued"
+        ):
+            if skip:
+                skipped += 1
+                continue
+            reminders.append(
+                Reminder(
+                    datetime=now,
+                    subject=subject,
+                    recipient_id=user_id,
+                    balance=balance,
+                    next_attempt_at=now,
+                )
+            )
+        return len(self.bulk_create(reminders, batch_size=500)), skipped
+
+    def campaign_recipients(
+        self, min_debt, min_days, exclude_recent_payers=True, now=None
+    ):
+        """Return the debtors due for a reminder, as a single query.
+
+        They owe at least min_debt and weren't reminded in the last min_days
+        days. Those who paid something since their last reminder are left out
+        with exclude_recent_payers.
+        """
+        now = now or timezone.now()
+        last_reminder = (
+            self.filter(recipient=OuterRef("pk"))
+            .order_by("-datetime")
+            .values("datetime")[:1]
+        )
+        recipients = User.objects.filter(
+            profile_ac__current_amount__lt=0,
+            profile_ac__current_amount__lte=-min_debt,
+        ).annotate(
+            last_reminder=Subquery(last_reminder),
+            last_reminder_day=TruncDate("last_reminder"),
+        )
+        recipients = recipients.filter(
+            Q(last_reminder__isnull=True)
+            | Q(last_reminder__lte=now - timedelta(days=min_days))
+        )
+        if exclude_recent_payers:
+            # Paid the day of the reminder or later
+            recent_payments = Transaction.objects.filter(
+                user=OuterRef("pk"),
+                is_deleted=False,
+                amount__gt=0,
+                date_event__gte=OuterRef("last_reminder_day"),
+            )
+            recipients = recipients.exclude(Exists(recent_payments))
+        return recipients
+
+
 class Reminder(models.Model):
-    datetime = models.DateTimeField(default="")
+    """Debt reminder email, queued by the debt view and sent by send_reminders"""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", _("Pending")
+        SENDING = "sending", _("Sending")
+        SENT = "sent", _("Sent")
+        FAILED = "failed", _("Failed")
+
+    datetime = models.DateTimeField(default=timezone.now)
     subject = models.CharField(max_length=300)
     # type = models.TextChoices()
     recipient = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name="reminders",
+        # Covered by the reminder_recipient_idx index
+        db_index=False,
     )
     balance = models.DecimalField(
         max_digits=7,
         decimal_places=2,
     )
+    status = models.CharField(
+        _("status"), max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(_("attempts"), default=0)
+    next_attempt_at = models.DateTimeField(
+        _("next attempt"),
+        default=timezone.now,
+        help_text=_("A failed reminder is retried after a growing delay."),
+    )
+    sent_at = models.DateTimeField(_("sending date"), null=True, blank=True)
+    error = models.TextField(_("error"), blank=True)
+    updated_at = models.DateTimeField(_("last update"), auto_now=True)
+
+    objects = ReminderManager()
+
+    class Meta:
+        indexes = [
+            # The reminders the worker has to send, the oldest first
+            models.Index(fields=["status", "next_attempt_at"], name="reminder_due_idx"),
+            # The last reminder of each user, for the campaigns
+            models.Index(
+                fields=["recipient", "datetime"], name="reminder_recipient_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} ({self.recipient})"
+
+
+class ImportJob(models.Model):
+    """Import of an AssoConnect export, run by the run_import_jobs command"""
+
+    class Category(models.TextChoices):
+        MEMBER_LIST = "Members", _("List of members")
+        TRANSACTION_LIST = "Transactions", _("List of transactions")
+        BALANCES_LIST = "Balances", _("List of initial and current balances")
+
+    class Status(models.TextChoices):
+        PENDING = "pending", _("Pending")
+        RUNNING = "running", _("Running")
+        SUCCEEDED = "succeeded", _("Succeeded")
+        FAILED = "failed", _("Failed")
+
+    category = models.CharField(
+        _("file category"), max_length=20, choices=Category.choices
+    )
+    file = models.FileField(_("imported file"), upload_to="imports/")
+    status = models.CharField(
+        _("status"), max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    phase = models.CharField(_("phase"), max_length=50, default="queued")
+    rows_processed = models.PositiveIntegerField(
+        _("rows processed"),
+        default=0,
+        help_text=_("Rows committed so far, an interrupted import resumes after them."),
+    )
+    counts = models.JSONField(_("counts"), default=dict, blank=True)
+    file_fingerprint = models.CharField(
+        _("file fingerprint"), max_length=64, blank=True
+    )
+    error = models.TextField(_("error"), blank=True)
+    created_at = models.DateTimeField(_("creation date"), auto_now_add=True)
+    started_at = models.DateTimeField(_("start date"), null=True, blank=True)
+    finished_at = models.DateTimeField(_("end date"), null=True, blank=True)
+    updated_at = models.DateTimeField(_("last update"), auto_now=True)
+
+    def __str__(self):
+        return f"{self.get_category_display()} ({self.created_at:%d/%m/%Y %H:%M})"
+
+    @property
+    def rows_per_second(self):
+        if not self.started_at:
+            return None
+        elapsed = (
+            (self.finished_at or timezone.now()) - self.started_at
+        ).total_seconds()
+        return round(self.rows_processed / elapsed, 1) if elapsed else None
+
+    @property
+    def summary(self):
+        """Outcome of the import, worded as the import page reports it"""
+        if self.status == ImportJob.Status.FAILED:
+            return _("Import failed: %s") % self.error
+        if self.status != ImportJob.Status.SUCCEEDED:
+            return ""
+        if self.category == ImportJob.Category.MEMBER_LIST:
+            details = f"{self.counts.get('members_added', 0)} member(s) added"
+        elif self.category == ImportJob.Category.TRANSACTION_LIST:
+            details = f"{self.counts.get('transactions_added', 0)} transaction(s) added"
+            if unmatched := self.counts.get("unmatched"):
+                details += f", no member found for: {', '.join(unmatched)}"
+            if ambiguous := self.counts.get("ambiguous"):
+                details += f", several members found for: {', '.join(ambiguous)}"
+        else:
+            details = f"{self.counts.get('balances_updated', 0)} balance(s) updated"
+            if unknown_contacts := self.counts.get("unknown_contacts"):
+                details += ", unknown contact identifier(s): " + ", ".join(
+                    map(str, unknown_contacts)
+                )
+        return _("Imported successfully") + f" ({details})"
+
+    def as_status(self):
+        return {
+            "id": self.pk,
+            "category": self.category,
+            "status": self.status,
+            "phase": self.phase,
+            "rows_processed": self.rows_processed,
+            "rows_per_second": self.rows_per_second,
+            "counts": self.counts,
+            "summary": str(self.summary),
+        }
+
+
+class StagedTransaction(models.Model):
+    """Line of a transactions import, kept until the whole file is imported
+
+    See StagedTransactionImporter, which merges them into Transaction.
+    """
+
+    job = models.ForeignKey(
+        ImportJob,
+        on_delete=models.CASCADE,
+        related_name="staged_transactions",
+        # Covered by the stagedtransaction_job_unique constraint
+        db_index=False,
+    )
+    entity_id = models.PositiveIntegerField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+        db_index=False,
+    )
+    idDocument = models.PositiveIntegerField()
+    provided_title = models.CharField(max_length=300)
+    amount = models.DecimalField(max_digits=7, decimal_places=2)
+    date_event = models.DateField()
+    fingerprint = models.CharField(max_length=40)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["job", "entity_id"], name="stagedtransaction_job_unique"
+            ),
+        ]
+        indexes = [
+            # Staged totals by user, to validate them against the balances
+            models.Index(
+                fields=["job", "user", "amount"], name="stagedtransaction_user_idx"
+            ),
+        ]
+
+    def as_transaction(self):
+        return Transaction(
+            entity_id=self.entity_id,
+            user_id=self.user_id,
+            idDocument=self.idDocument,
+            provided_title=self.provided_title,
+            amount=self.amount,
+            date_event=self.date_event,
+            fingerprint=self.fingerprint,
+        )
+
+
+class DataGenerationManager(models.Manager):
+    def current(self):
+        return self.filter(pk=1).values_list("value", flat=True).first() or 0
+
+    def bump(self):
+        """Mark the imported data as changed, the cached pages become stale"""
+        if not self.filter(pk=1).update(value=F("value") + 1):
+            self.get_or_create(pk=1, defaults={"value": 1})
+
+
+class DataGeneration(models.Model):
+    """Counter of the changes of the imported data, versioning the cached pages.
+
+    It is stored in the database so that the import worker and the web server
+    processes agree on it, whatever the cache backend.
+    """
+
+    value = models.PositiveBigIntegerField(_("generation"), default=0)
+
+    objects = DataGenerationManager()
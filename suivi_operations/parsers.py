@@ -0,0 +1,37 @@
+"""Parsers for the values found in AssoConnect exports.
+
+Exports repeat a small set of dates and amounts, so the parsers are memoized
+with bounded caches. Cached values are immutable (date, Decimal).
+"""
+from datetime import date
+from decimal import ROUND_HALF_EVEN, Decimal
+from functools import lru_cache
+
+TWO_PLACES = Decimal("0.01")
+
+
+@lru_cache(maxsize=4096)
+def parse_day_first_date(value):
+    """Parse a "dd/mm/YYYY" date, raise ValueError if it isn't valid"""
+    day, month, year = value.split("/")
+    return date(int(year), int(month), int(day))
+
+
+@lru_cache(maxsize=4096)
+def parse_month_first_date(value):
+    """Parse a "mm/dd/YYYY" date, raise ValueError if it isn't valid"""
+    month, day, year = value.split("/")
+    return date(int(year), int(month), int(day))
+
+
+@lru_cache(maxsize=65536)
+def parse_amount(value):
+    """Parse a French formatted amount such as "1 234,50" into a Decimal
+
+    Thousands are separated by a narrow no-break space (or a no-break space)
+    and decimals by a comma. Raise decimal.InvalidOperation if it isn't valid.
+    The rounding is explicit: a cached amount mustn't depend on the decimal
+    context of the first caller.
+    """
+    value = value.replace("\u202f", "").replace("\xa0", "").replace(",", ".")
+    return Decimal(value).quantize(TWO_PLACES, rounding=ROUND_HALF_EVEN)
@@ -0,0 +1,174 @@
+"""Opt-in profiling of the requests: SQL queries, template rendering and time.
+
+Enabled by the REQUEST_PROFILING setting. Every request is logged by the
+"suivi_operations.profiling" logger, with the measures in the request_profile
+attribute of the log record, and the latest ones are kept in memory for the
+staff page of the slowest requests.
+"""
+import logging
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Placeholder lists and rows of bulk inserts, whatever their length
+PLACEHOLDERS = re.compile(r"%s(?:, %s)+")
+REPEATED_ROWS = re.compile(r"(\([^()]*\))(?:, \1)+")
+
+
+def query_fingerprint(sql):
+    """Return the SQL of a query with its lists of parameters collapsed"""
+    sql = PLACEHOLDERS.sub("%s, ...", sql)
+    return REPEATED_ROWS.sub(r"\1, ...", sql)
+
+
+@dataclass
+class RepeatedQuery:
+    fingerprint: str
+    count: int
+    seconds: float
+
+
+@dataclass
+class RequestProfile:
+    method: str
+    path: str
+    status_code: int
+    date: datetime
+    seconds: float
+    sql_count: int
+    sql_seconds: float
+    render_seconds: float
+    # Queries run more than once, the most repeated first
+    repeated_queries: list = field(default_factory=list)
+    # The same query run for each item of a list, typically
+    n_plus_one: bool = False
+
+    def as_dict(self):
+        profile = asdict(self)
+        profile["date"] = self.date.isoformat()
+        return profile
+
+
+class QueryRecorder:
+    """Execute wrapper timing the queries, grouped by fingerprint"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+        self.fingerprints = defaultdict(lambda: [0, 0])
+        self.render_seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start
+            self.count += 1
+            self.seconds += seconds
+            stats = self.fingerprints[query_fingerprint(sql)]
+            stats[0] += 1
+            stats[1] += seconds
+
+    def repeated_queries(self):
+        repeated = [
+            RepeatedQuery(fingerprint, count, seconds)
+            for fingerprint, (count, seconds) in self.fingerprints.items()
+            if count > 1
+        ]
+        return sorted(repeated, key=lambda query: query.count, reverse=True)
+
+
+class RequestProfileHistory:
+    """The latest request profiles of the process"""
+
+    def __init__(self):
+        self._profiles = deque()
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        size = getattr(settings, "REQUEST_PROFILING_HISTORY", 200)
+        with self._lock:
+            self._profiles.append(profile)
+            while len(self._profiles) > size:
+                self._profiles.popleft()
+
+    def slowest(self, count=50):
+        with self._lock:
+            profiles = list(self._profiles)
+        return sorted(profiles, key=lambda profile: profile.seconds, reverse=True)[
+            :count
+        ]
+
+
+history = RequestProfileHistory()
+
+
+class RequestProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_PROFILING", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._query_recorder = recorder
+        date = timezone.now()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - start
+
+        repeated_queries = recorder.repeated_queries()
+        threshold = getattr(settings, "REQUEST_PROFILING_REPEATED_QUERIES", 5)
+        profile = RequestProfile(
+            method=request.method,
+            path=request.path,
+            status_code=response.status_code,
+            date=date,
+            seconds=seconds,
+            sql_count=recorder.count,
+            sql_seconds=recorder.seconds,
+            render_seconds=recorder.render_seconds,
+            repeated_queries=repeated_queries,
+            n_plus_one=bool(repeated_queries)
+            and repeated_queries[0].count >= threshold,
+        )
+        history.add(profile)
+        logger.log(
+            logging.WARNING if profile.n_plus_one else logging.INFO,
+            "%s %s %s: %d queries in %.1f ms, rendered in %.1f ms, %.1f ms in total%s",
+            profile.method,
+            profile.path,
+            profile.status_code,
+            profile.sql_count,
+            profile.sql_seconds * 1000,
+            profile.render_seconds * 1000,
+            profile.seconds * 1000,
+            ", likely N+1 queries" if profile.n_plus_one else "",
+            extra={"request_profile": profile.as_dict()},
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # The response is rendered right after the template response hooks
+        start = time.perf_counter()
+
+        def record_render(response):
+            request._query_recorder.render_seconds = time.perf_counter() - start
+
+        response.add_post_render_callback(record_render)
+        return response
@@ -0,0 +1,85 @@
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from .models import User
+
+
+def normalize_name(name):
+    """Fold accents, case, hyphens and repeated spaces of a person name"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in decomposed if not unicodedata.combining(char))
+    for separator in ("-", "'", "’"):
+        name = name.replace(separator, " ")
+    return " ".join(name.casefold().split())
+
+
+@dataclass
+class ResolutionReport:
+    """Ledger labels that could not be linked to exactly one user"""
+
+    unmatched: Counter = field(default_factory=Counter)
+    ambiguous: dict = field(default_factory=dict)
+
+    def __bool__(self):
+        return bool(self.unmatched or self.ambiguous)
+
+
+class UserNameResolver:
+    """Match AssoConnect ledger labels ("411XXX - First Last") to users.
+
+    The user names are indexed once, so resolving a label costs no query and
+    each distinct label is only resolved once per import.
+    """
+
+    def __init__(self, users=None):
+        if users is None:
+            users = User.objects.only("pk", "email", "first_name", "last_name")
+
+        self._full_names = defaultdict(list)
+        self._last_words = defaultdict(list)
+        for user in users:
+            first_name = normalize_name(user.first_name)
+            last_name = normalize_name(user.last_name)
+            if not first_name or not last_name:
+                continue
+            self._full_names[f"{first_name} {last_name}"].append(user)
+            self._last_words[last_name.split()[-1]].append((first_name, user))
+
+        self._resolved = {}
+        self.report = ResolutionReport()
+
+    @staticmethod
+    def label_to_name(label):
+        return label.split(" - ")[-1]
+
+    def _candidates(self, name):
+        # Exact match first, it handles multi-word first and last names
+        if candidates := self._full_names.get(name):
+            return candidates
+
+        # Otherwise first name starting with the first word, last name ending
+        # with the last word of the label
+        words = name.split()
+        if not words:
+            return []
+        return [
+            user
+            for first_name, user in self._last_words.get(words[-1], [])
+            if first_name.startswith(words[0])
+        ]
+
+    def resolve(self, label):
+        """Return the user matching the label, or None if there isn't exactly one"""
+        if label in self._resolved:
+            user = self._resolved[label]
+        else:
+            candidates = self._candidates(normalize_name(self.label_to_name(label)))
+            user = candidates[0] if len(candidates) == 1 else None
+            if len(candidates) > 1:
+                self.report.ambiguous[label] = candidates
+            self._resolved[label] = user
+
+        if user is None and label not in self.report.ambiguous:
+            self.report.unmatched[label] += 1
+        return user
@@ -1,8 +1,9 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from .models import ProfileAC
+from .models import DataGeneration, MonthlyBalance, ProfileAC, Transaction
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL, dispatch_uid="create_profile_ac")
@@ -14,3 +15,51 @@ def create_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=settings.AUTH_USER_MODEL, dispatch_uid="maj_profile_ac")
 def save_profile(sender, instance, **kwargs):
     instance.profile_ac.save()
+
+
+@receiver(
+    post_save, sender=settings.AUTH_USER_MODEL, dispatch_uid="maj_generation_user"
+)
+def bump_data_generation_user(sender, instance, update_fields=None, **kwargs):
+    # The list shows the names and emails, but logins only store their date
+    if update_fields != {"last_login"}:
+        DataGeneration.objects.bump()
+
+
+@receiver(pre_save, sender=Transaction, dispatch_uid="maj_totals_owner")
+def remember_previous_owner(sender, instance, **kwargs):
+    # An edit may move the line to another member
+    instance._previous_user_id = (
+        Transaction.objects.filter(pk=instance.pk)
+        .values_list("user_id", flat=True)
+        .first()
+    )
+
+
+# Bulk imports refresh the totals themselves, these handle single edits
+@receiver(post_save, sender=Transaction, dispatch_uid="maj_totals_save")
+@receiver(post_delete, sender=Transaction, dispatch_uid="maj_totals_delete")
+def refresh_transaction_totals(sender, instance, **kwargs):
+    user_ids = {instance.user_id}
+    if previous_user_id := getattr(instance, "_previous_user_id", None):
+        user_ids.add(previous_user_id)
+    ProfileAC.objects.refresh_transaction_totals(user_ids)
+    MonthlyBalance.objects.refresh(user_ids)
+    DataGeneration.objects.bump()
+
+
+@receiver(post_save, sender=ProfileAC, dispatch_uid="maj_generation_profile")
+def bump_data_generation(sender, instance, **kwargs):
+    # Every save of a user saves its profile, logins included
+    if instance.imported_fields_changed():
+        DataGeneration.objects.bump()
+
+
+@receiver(connection_created, dispatch_uid="sqlite_pragmas")
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Tune every new SQLite connection with the SQLITE_PRAGMAS setting"""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
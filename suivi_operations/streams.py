@@ -0,0 +1,124 @@
+import codecs
+import csv
+import hashlib
+import json
+from itertools import chain, islice
+
+# Bytes read from the uploaded file at once
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_text(file, encoding="utf-8-sig", chunk_size=CHUNK_SIZE):
+    """Decode an uploaded file chunk by chunk.
+
+    The default encoding also drops the byte order mark added by spreadsheet
+    softwares. Raise UnicodeDecodeError when the content doesn't match the
+    encoding.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in file.chunks(chunk_size):
+        if text := decoder.decode(chunk):
+            yield text
+    if text := decoder.decode(b"", final=True):
+        yield text
+
+
+def file_fingerprint(file, chunk_size=CHUNK_SIZE):
+    """SHA-256 of the file content, read chunk by chunk"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks(chunk_size):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_lines(file, **kwargs):
+    """Yield the lines of an uploaded file, line endings included"""
+    pending = ""
+    for text in iter_text(file, **kwargs):
+        lines = (pending + text).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+
+def iter_csv_rows(file, **kwargs):
+    """Yield the lines of a CSV file as dictionaries"""
+    yield from csv.DictReader(iter_lines(file, **kwargs))
+
+
+def read_csv_header(file, **kwargs):
+    """Return the column names of a CSV file, reading only its first line"""
+    first_line = next(iter_lines(file, **kwargs), "")
+    return next(csv.reader([first_line]), [])
+
+
+def iter_json_items(file, **kwargs):
+    """Yield the items of a JSON array one by one, without loading the file
+
+    Raise json.JSONDecodeError when the file isn't a single JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    # "[" to start with, an item or "]" right after it, "," or "]" after each
+    # item, an item after each ",", then nothing but blanks
+    expecting = "start"
+
+    for text in chain(iter_text(file, **kwargs), [None]):
+        exhausted = text is None
+        if not exhausted:
+            buffer = buffer[position:] + text
+            position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position == len(buffer):
+                break
+
+            char = buffer[position]
+            if expecting == "start":
+                if char != "[":
+                    raise json.JSONDecodeError("Expecting an array", buffer, position)
+                expecting = "first item"
+                position += 1
+            elif expecting == "end":
+                raise json.JSONDecodeError("Extra data", buffer, position)
+            elif char == "]" and expecting in ("first item", "separator"):
+                expecting = "end"
+                position += 1
+            elif expecting == "separator":
+                if char != ",":
+                    raise json.JSONDecodeError(
+                        "Expecting ',' delimiter", buffer, position
+                    )
+                expecting = "item"
+                position += 1
+            elif char in ",]":
+                raise json.JSONDecodeError("Expecting value", buffer, position)
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if exhausted:
+                        raise
+                    # The item continues in the next chunk
+                    break
+                # A number may continue in the next chunk too
+                if end == len(buffer) and not exhausted:
+                    break
+                position = end
+                expecting = "separator"
+                yield item
+
+        if exhausted and expecting != "end":
+            raise json.JSONDecodeError("Unterminated array", buffer, len(buffer))
+
+
+def iter_batches(iterable, size):
+    """Group the items of an iterable in lists of at most size items"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
@@ -0,0 +1,188 @@
+"""Synthetic AssoConnect exports, used to benchmark the imports and views.
+
+The files have the columns the importers read: the member list and balances
+as CSV files with the French headers, and the general ledger in the JSON
+shape produced by tools/script_tojson.js. Members, ledger and balances are
+consistent with each other, apart from a few discrepancies and unknown names
+as found in real exports.
+"""
+import csv
+import json
+import random
+from dataclasses import dataclass
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+MEMBER_COLUMNS = [
+    "ID du Contact",
+    "Prénom",
+    "Nom",
+    "Email",
+    "Sexe",
+    "Date de naissance",
+    "Téléphone mobile",
+    "Statut adhérent",
+    "Membre annuels (aides CS)",
+    "Détail",
+]
+BALANCE_COLUMNS = [
+    "ID",
+    "Nom",
+    "Solde en début de période (EUR)",
+    "Solde à la date T (EUR)",
+]
+
+# fmt: off
+SYLLABLES = [
+    "ba", "ber", "bou", "cha", "clé", "da", "del", "du", "fa", "fer", "gal",
+    "gi", "jo", "la", "lé", "lou", "ma", "mar", "mi", "mo", "na", "nou", "pa",
+    "per", "ra", "ri", "ro", "sa", "sé", "ta", "ti", "va", "vi", "zo",
+]
+# fmt: on
+TITLES = [
+    "Cotisation annuelle",
+    "Inscription tournoi",
+    "Licence FFFD",
+    "Paiement carte bancaire",
+    "Remboursement frais de déplacement",
+    "Maillot du club",
+]
+# Average number of ledger lines per member
+LINES_PER_MEMBER = 5
+SEASON_START = date(2022, 9, 1)
+
+
+def format_amount(amount):
+    """Format a Decimal the way AssoConnect does, as "1 234,50" """
+    return f"{amount:,.2f}".replace(",", "\u202f").replace(".", ",")
+
+
+@dataclass
+class Member:
+    id_contact: int
+    first_name: str
+    last_name: str
+    initial_amount: Decimal
+    transactions_amount: Decimal = Decimal("0.00")
+
+
+class SyntheticExport:
+    """Members, ledger lines and balances of a club of the given size"""
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.random = random.Random(seed)
+        self.members = [self.make_member(number) for number in range(size)]
+
+    def make_name(self, syllables):
+        name = "".join(self.random.choice(SYLLABLES) for _ in range(syllables))
+        return name.capitalize()
+
+    def make_member(self, number):
+        first_name = self.make_name(2)
+        if self.random.random() < 0.05:
+            first_name += "-" + self.make_name(2)
+        amount = Decimal(self.random.randrange(-5000, 5000, 50)) / 100
+        return Member(
+            id_contact=7_000_000 + number,
+            first_name=first_name,
+            last_name=self.make_name(3),
+            initial_amount=amount if self.random.random() < 0.3 else Decimal(0),
+        )
+
+    def write_members(self, path):
+        with open(path, "w", newline="", encoding="utf-8-sig") as file:
+            writer = csv.DictWriter(file, MEMBER_COLUMNS)
+            writer.writeheader()
+            for number, member in enumerate(self.members):
+                birth_date = date(1970, 1, 1) + timedelta(
+                    days=self.random.randrange(40 * 365)
+                )
+                writer.writerow(
+                    {
+                        "ID du Contact": member.id_contact,
+                        "Prénom": member.first_name,
+                        "Nom": member.last_name.upper(),
+                        "Email": f"membre{number}@example.org",
+                        "Sexe": self.random.choice(["Masculin", "Féminin", ""]),
+                        "Date de naissance": birth_date.strftime("%m/%d/%Y"),
+                        "Téléphone mobile": f"06{self.random.randrange(10**8):08d}",
+                        "Statut adhérent": self.random.choice(
+                            ["Adhérent", "Adhérent", "Non adhérent"]
+                        ),
+                        "Membre annuels (aides CS)": self.random.choice(["", "Oui"]),
+                        "Détail": "https://www.assoconnect.com/contacts/"
+                        f"{member.id_contact}",
+                    }
+                )
+
+    def write_ledger(self, path):
+        """Write the general ledger as a JSON array, one line at a time"""
+        lines = self.size * LINES_PER_MEMBER
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("[")
+            for entity_id in range(1, lines + 1):
+                member = self.random.choice(self.members)
+                amount = Decimal(self.random.randrange(-15000, 10000, 50)) / 100
+                # Some labels don't match any member name
+                name = f"{member.first_name} {member.last_name}"
+                if self.random.random() < 0.001:
+                    name = self.make_name(2) + " " + self.make_name(3)
+                else:
+                    member.transactions_amount += amount
+
+                day = SEASON_START + timedelta(days=self.random.randrange(365))
+                line = {
+                    "Date": day.strftime("%d/%m/%Y"),
+                    "Id pièce": str(100_000 + entity_id // 2),
+                    "Journal": "VT" if amount < 0 else "BQ",
+                    "Intitulé": f"{self.random.choice(TITLES)} - "
+                    f"Transaction #{entity_id}",
+                    "Débit (EUR)": format_amount(-amount) if amount < 0 else "",
+                    "Crédit (EUR)": format_amount(amount) if amount >= 0 else "",
+                    "entity_id": str(entity_id),
+                    "user_id": f"411{member.id_contact} - {name}",
+                }
+                if entity_id > 1:
+                    file.write(",")
+                file.write(json.dumps(line, ensure_ascii=False))
+            file.write("]")
+
+    def write_balances(self, path):
+        """Write the balances, to call after write_ledger for the totals"""
+        with open(path, "w", newline="", encoding="utf-8-sig") as file:
+            writer = csv.DictWriter(file, BALANCE_COLUMNS)
+            writer.writeheader()
+            for member in self.members:
+                current_amount = member.initial_amount + member.transactions_amount
+                # Discrepancies to reconcile
+                if self.random.random() < 0.02:
+                    current_amount += Decimal(self.random.randrange(1, 100))
+                # The balances are exported from the club perspective
+                writer.writerow(
+                    {
+                        "ID": member.id_contact,
+                        "Nom": f"{member.last_name.upper()} {member.first_name}",
+                        "Solde en début de période (EUR)": format_amount(
+                            -member.initial_amount
+                        ),
+                        "Solde à la date T (EUR)": format_amount(-current_amount),
+                    }
+                )
+
+
+def write_export(directory, size, seed=0):
+    """Write the three export files in a directory and return their paths"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    export = SyntheticExport(size, seed=seed)
+    paths = {
+        "members": directory / f"members_{size}.csv",
+        "transactions": directory / f"transactions_{size}.json",
+        "balances": directory / f"balances_{size}.csv",
+    }
+    export.write_members(paths["members"])
+    export.write_ledger(paths["transactions"])
+    export.write_balances(paths["balances"])
+    return paths
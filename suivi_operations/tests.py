@@ -1,3 +1,1884 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation, localcontext
+from smtplib import SMTPRecipientsRefused
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail, signing
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import Http404, HttpResponse, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.template import TemplateSyntaxError
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils import timezone
+from django.views.generic.base import View
+
+from .importers import (
+    BalanceImporter,
+    LedgerValidationError,
+    MemberImporter,
+    ParseStage,
+    StagedTransactionImporter,
+    TransactionImporter,
+    claim_import_job,
+    run_import_job,
+)
+from .mailing import (
+    DEBT_TEMPLATE,
+    RateLimiter,
+    debt_message,
+    deliver_reminders,
+    load_debt_template,
+)
+from .models import (
+    DataGeneration,
+    ImportJob,
+    MonthlyBalance,
+    ProfileAC,
+    Reminder,
+    StagedTransaction,
+    Transaction,
+    User,
+)
+from .parsers import parse_amount, parse_day_first_date, parse_month_first_date
+from .profiling import RequestProfilingMiddleware, history, query_fingerprint
+from .resolvers import UserNameResolver
+from .streams import iter_csv_rows, iter_json_items, iter_lines, read_csv_header
+from .views import KeysetPaginationMixin, SendDebtMailView, UserListView
+
+# "SCAN table" (or "SCAN TABLE table" before SQLite 3.36) reads the whole
+# table, "SCAN table USING [COVERING] INDEX" walks an index instead
+FULL_SCAN = re.compile(
+    r"\bSCAN (?:TABLE )?+(?!CONSTANT ROW)(\S+)(?!\S)(?! USING (?:COVERING )?INDEX\b)"
+)
+
+
+class QueryRecorder:
+    """Execute wrapper keeping the SELECT statements run by the database"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith("SELECT"):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite query plans")
+class QueryPlanTests(TestCase):
+    """The views' queries must use the indexes, whatever the size of the ledger"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(3):
+            user = User.objects.create_user(f"member{number}@example.com")
+            user.last_name = f"Member {number}"
+            user.save()
+            Transaction.objects.create(
+                entity_id=number + 1,
+                user=user,
+                idDocument=number + 1,
+                provided_title="Cotisation",
+                amount=Decimal("-20.00"),
+                date_event=date(2023, 9, 1),
+            )
+            profile = user.profile_ac
+            profile.current_amount = Decimal("-20.00")
+            profile.save()
+
+    def setUp(self):
+        # Cached pages would skip the queries under test
+        cache.clear()
+
+    def query_plan(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    @contextmanager
+    def assertNoFullScan(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            yield
+        self.assertTrue(recorder.queries)
+
+        for sql, params in recorder.queries:
+            for step in self.query_plan(sql, params):
+                if match := FULL_SCAN.search(step):
+                    self.fail(f"Full scan of {match[1]} in: {sql}")
+
+    def test_full_scan_pattern(self):
+        for step, table in (
+            ("SCAN suivi_operations_user", "suivi_operations_user"),
+            ("SCAN TABLE suivi_operations_user", "suivi_operations_user"),
+            ("SCAN suivi_operations_user USING INDEX user_last_name_idx", None),
+            ("SCAN TABLE suivi_operations_user USING COVERING INDEX idx", None),
+            ("SEARCH suivi_operations_user USING INDEX idx (email>?)", None),
+            ("SCAN CONSTANT ROW", None),
+        ):
+            with self.subTest(step):
+                match = FULL_SCAN.search(step)
+                self.assertEqual(match and match[1], table)
+
+    def test_user_list(self):
+        url = reverse("list_user")
+        for query in (
+            {"sort": "diff_amount"},
+            {"sort": "-diff_amount"},
+            {"sort": "current_amount"},
+            {"sort": "last_name"},
+            {"debtors": "on"},
+            {"discrepancies": "on"},
+        ):
+            with self.subTest(**query), self.assertNoFullScan():
+                self.assertEqual(self.client.get(url, query).status_code, 200)
+
+    @mock.patch.object(UserListView, "paginate_by", 2)
+    def test_user_list_next_page(self):
+        url = reverse("list_user")
+        next_query = self.client.get(url).context["next_query"]
+        with self.assertNoFullScan():
+            response = self.client.get(f"{url}?{next_query}")
+        self.assertEqual(len(response.context["object_list"]), 1)
+
+    def test_debt_form(self):
+        url = reverse("debt_mail_form")
+        for query in ({}, {"q": "member"}, {"min_debt": "10", "max_debt": "50"}):
+            with self.subTest(**query), self.assertNoFullScan():
+                self.assertEqual(self.client.get(url, query).status_code, 200)
+
+    def test_debt_mail(self):
+        users = list(ProfileAC.objects.values_list("user", flat=True))
+        with self.assertNoFullScan():
+            self.client.post(reverse("debt_mail_form"), {"users": users})
+        self.assertEqual(Reminder.objects.count(), len(users))
+        with self.assertNoFullScan():
+            list(deliver_reminders())
+        self.assertEqual(len(mail.outbox), len(users))
+
+    def test_transaction_totals(self):
+        users = list(ProfileAC.objects.values_list("user", flat=True))
+        with self.assertNoFullScan():
+            ProfileAC.objects.refresh_transaction_totals(users[:2])
+
+    def test_balance(self):
+        url = reverse("balance")
+        for query in ({"date": "2023-09-15"}, {"date": "2023-09-15", "user": 1}):
+            with self.subTest(**query), self.assertNoFullScan():
+                self.assertEqual(self.client.get(url, query).status_code, 200)
+
+    def test_reminder_campaign(self):
+        url = reverse("reminder_campaign")
+        data = {"min_debt": "10", "min_days": "30", "exclude_recent_payers": "on"}
+        with self.assertNoFullScan():
+            self.client.post(url, {**data, "preview": "Aperçu"})
+        with self.assertNoFullScan():
+            self.client.post(url, data)
+        self.assertEqual(Reminder.objects.count(), 3)
+
+    def test_admin_user_search(self):
+        self.client.force_login(User.objects.create_superuser("staff@example.com"))
+        url = reverse("admin:suivi_operations_user_changelist")
+        for query in ({"q": "member0@"}, {"q": "member 1"}):
+            recorder = QueryRecorder()
+            with self.subTest(**query), self.assertNoFullScan():
+                with connection.execute_wrapper(recorder):
+                    response = self.client.get(url, query)
+                self.assertEqual(response.context["cl"].result_count, 1)
+                # Not even a walk of a whole index of the users
+                for sql, params in recorder.queries:
+                    for step in self.query_plan(sql, params):
+                        self.assertNotRegex(step, r"\bSCAN suivi_operations_user\b")
+
+    def test_balance_history(self):
+        for url in (
+            reverse("balance_history"),
+            reverse("user_balance_history", args=[1]),
+        ):
+            with self.subTest(url=url), self.assertNoFullScan():
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class AdminQueryBudgetTests(TestCase):
+    """Admin pages run as many queries whatever the size of the ledger"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser("staff@example.com", "password")
+        cls.member = User.objects.create_user("member@example.com")
+        ProfileAC.objects.filter(user=cls.member).update(idContact=7000001)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def add_members(self, count):
+        for number in range(count):
+            User.objects.create_user(f"member{User.objects.count()}@example.com")
+
+    def add_transactions(self, count):
+        start = Transaction.objects.count()
+        Transaction.objects.bulk_create(
+            Transaction(
+                entity_id=start + number + 1,
+                user=self.member,
+                idDocument=number,
+                provided_title=f"Cotisation {number}",
+                amount=Decimal("-5.00"),
+                date_event=date(2023, 9, 1),
+            )
+            for number in range(count)
+        )
+
+    def count_queries(self, url, queries):
+        counts = {}
+        for query in queries:
+            # The first request warms the content types cache up
+            self.client.get(url, query)
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url, query)
+            self.assertEqual(response.status_code, 200)
+            counts[str(query)] = len(captured)
+        return counts
+
+    def test_user_change_page(self):
+        url = reverse("admin:suivi_operations_user_change", args=[self.member.pk])
+        self.add_transactions(2)
+        counts = self.count_queries(url, [{}])
+        self.add_transactions(50)
+        self.assertEqual(self.count_queries(url, [{}]), counts)
+
+    def test_transaction_list(self):
+        url = reverse("admin:suivi_operations_transaction_changelist")
+        queries = [
+            {},
+            {"is_deleted__exact": "0"},
+            {"date_event__year": "2023"},
+            {"q": "member@"},
+            {"q": "cotisation"},
+            {"q": "7000001"},
+        ]
+        self.add_transactions(2)
+        counts = self.count_queries(url, queries)
+        self.add_transactions(50)
+        self.assertEqual(self.count_queries(url, queries), counts)
+
+    def test_profile_list(self):
+        url = reverse("admin:suivi_operations_profileac_changelist")
+        queries = [{}, {"member_revo__exact": "1"}, {"q": "member"}]
+        self.add_members(2)
+        counts = self.count_queries(url, queries)
+        self.add_members(20)
+        self.assertEqual(self.count_queries(url, queries), counts)
+
+
+class UserListTests(TestCase):
+    """The reconciliation list and its pages"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for number, (current_amount, transactions_amount) in enumerate(
+            (("-20.00", "-20.00"), ("-5.00", "-10.00"), ("10.00", "0.00"))
+        ):
+            user = User.objects.create_user(f"member{number}@example.com")
+            user.last_name = f"Member {number}"
+            user.save()
+            profile = user.profile_ac
+            profile.current_amount = Decimal(current_amount)
+            profile.transactions_amount = Decimal(transactions_amount)
+            profile.save()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_missing_initial_balance(self):
+        response = self.client.get(reverse("list_user"), {"sort": "last_name"})
+        self.assertEqual(
+            [
+                (user.calculated_amount, user.diff_amount)
+                for user in response.context["object_list"]
+            ],
+            [
+                (Decimal("-20.00"), 0),
+                (Decimal("-10.00"), Decimal("5.00")),
+                (0, Decimal("10.00")),
+            ],
+        )
+
+    def test_data_generation(self):
+        generation = DataGeneration.objects.current()
+        user = User.objects.get(email="member0@example.com")
+        # Logins save the user, and so its profile
+        self.client.force_login(user)
+        self.assertEqual(DataGeneration.objects.current(), generation)
+
+        profile = ProfileAC.objects.get(user=user)
+        profile.current_amount = Decimal("-25.00")
+        profile.save()
+        self.assertEqual(DataGeneration.objects.current(), generation + 1)
+        profile.save()
+        self.assertEqual(DataGeneration.objects.current(), generation + 1)
+
+        user.first_name = "Renamed"
+        user.save()
+        self.assertEqual(DataGeneration.objects.current(), generation + 2)
+
+    def test_edited_email(self):
+        self.assertContains(
+            self.client.get(reverse("list_user")), "member0@example.com"
+        )
+        user = User.objects.get(email="member0@example.com")
+        user.email = "renamed@example.com"
+        user.save()
+        response = self.client.get(reverse("list_user"))
+        self.assertContains(response, "renamed@example.com")
+        self.assertNotContains(response, "member0@example.com")
+
+    def export(self, **query):
+        response = self.client.get(reverse("list_user_export"), query)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_export_csv(self):
+        content = self.export(format="csv", discrepancies="on")
+        self.assertTrue(content.startswith("\ufeff"))
+        self.assertEqual(
+            list(csv.reader(io.StringIO(content.removeprefix("\ufeff")))),
+            [
+                [
+                    "Courriel",
+                    "Montant actuel importé",
+                    "Montant actuel calculé",
+                    "Différence",
+                    "Adhérent Revolution'air",
+                    "Membre Championnet Sports",
+                ],
+                ["member1@example.com", "-5.00", "-10.00", "5.00", "False", "False"],
+                ["member2@example.com", "10.00", "0.00", "10.00", "False", "False"],
+            ],
+        )
+
+    def test_export_ndjson(self):
+        content = self.export(format="ndjson", debtors="on", sort="last_name")
+        self.assertEqual(
+            [json.loads(line) for line in content.splitlines()],
+            [
+                {
+                    "email": f"member{number}@example.com",
+                    "current_amount": current_amount,
+                    "calculated_amount": calculated_amount,
+                    "diff_amount": diff_amount,
+                    "member_revo": False,
+                    "member_CS": False,
+                }
+                for number, current_amount, calculated_amount, diff_amount in (
+                    (0, "-20.00", "-20.00", "0.00"),
+                    (1, "-5.00", "-10.00", "5.00"),
+                )
+            ],
+        )
+
+    def test_export_unknown_format(self):
+        response = self.client.get(reverse("list_user_export"), {"format": "xlsx"})
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch.object(UserListView, "paginate_by", 2)
+    def test_cursor_of_another_sort(self):
+        url = reverse("list_user")
+        response = self.client.get(url, {"sort": "last_name"})
+        after = QueryDict(response.context["next_query"])["after"]
+        # Starts over from the first page of the other sort
+        response = self.client.get(url, {"sort": "diff_amount", "after": after})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["object_list"]), 2)
+
+        response = self.client.get(url, {"sort": "last_name", "after": "forged"})
+        self.assertEqual(response.status_code, 404)
+
+
+class KeysetPaginationTests(TestCase):
+    """Pages start after the signed position of the last row of the previous one"""
+
+    class ListView(KeysetPaginationMixin, View):
+        cursor_salt = "test_list"
+
+        def get_sort(self):
+            return "last_name", "pk", "-" in self.request.GET.get("sort", "")
+
+    @classmethod
+    def setUpTestData(cls):
+        # A tie on the last name, broken by the primary keys
+        for email, last_name in (
+            ("alice@example.com", "Durand"),
+            ("bob@example.com", "Martin"),
+            ("carol@example.com", "Durand"),
+        ):
+            user = User.objects.create_user(email)
+            user.last_name = last_name
+            user.save()
+
+    def get_page(self, query, page_size=2):
+        view = self.ListView()
+        view.setup(RequestFactory().get("/list", query))
+        users, next_query = view.get_keyset_page(User.objects.all(), page_size)
+        return [user.email for user in users], next_query
+
+    def test_pages(self):
+        for sort, emails in (
+            ("", ["alice@example.com", "carol@example.com", "bob@example.com"]),
+            ("-", ["bob@example.com", "carol@example.com", "alice@example.com"]),
+        ):
+            with self.subTest(sort=sort):
+                first_page, next_query = self.get_page({"sort": sort})
+                self.assertEqual(first_page, emails[:2])
+                # The last page has no next one
+                last_page, next_query = self.get_page(QueryDict(next_query))
+                self.assertEqual(last_page, emails[2:])
+                self.assertIsNone(next_query)
+                # Neither has a page ending on the last row
+                self.assertEqual(self.get_page({"sort": sort}, 3), (emails, None))
+
+    def test_tampered_cursor(self):
+        after = QueryDict(self.get_page({})[1])["after"]
+        for cursor in (
+            after[:-1] + ("A" if after[-1] != "A" else "B"),
+            signing.dumps(["last_name", "Durand", 0], salt="user_list"),
+            "forged",
+        ):
+            with self.subTest(cursor=cursor), self.assertRaises(Http404):
+                self.get_page({"after": cursor})
+
+
+class TransactionEditTests(TestCase):
+    """Single edits, as made in the admin, refresh the stored totals"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.first_owner = User.objects.create_user("first@example.com")
+        cls.second_owner = User.objects.create_user("second@example.com")
+
+    def setUp(self):
+        self.transaction = Transaction.objects.create(
+            entity_id=1,
+            user=self.first_owner,
+            idDocument=1,
+            provided_title="Cotisation",
+            amount=Decimal("-10.00"),
+            date_event=date(2023, 9, 1),
+        )
+
+    def totals(self):
+        return list(
+            ProfileAC.objects.filter(user__in=[self.first_owner, self.second_owner])
+            .order_by("user")
+            .values_list("transactions_amount", "transactions_count")
+        )
+
+    def test_move_to_another_member(self):
+        self.assertEqual(self.totals(), [(Decimal("-10.00"), 1), (0, 0)])
+        self.transaction.user = self.second_owner
+        self.transaction.save()
+        self.assertEqual(self.totals(), [(0, 0), (Decimal("-10.00"), 1)])
+
+        self.transaction.delete()
+        self.assertEqual(self.totals(), [(0, 0), (0, 0)])
+
+    def test_monthly_balances_of_moved_line(self):
+        self.transaction.user = self.second_owner
+        self.transaction.save()
+        self.assertQuerysetEqual(
+            MonthlyBalance.objects.order_by("user"),
+            [(self.second_owner.pk, date(2023, 9, 1), Decimal("-10.00"))],
+            transform=lambda month: (month.user_id, month.month, month.balance),
+        )
+
+
+class BalanceTests(TestCase):
+    """Balances at a date and histories agree with the summed ledger"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice@example.com")
+        cls.bob = User.objects.create_user("bob@example.com")
+        ProfileAC.objects.filter(user=cls.alice).update(initial_amount=Decimal("5.10"))
+        cls.lines = [
+            (cls.alice, "-10.10", date(2023, 9, 5), False),
+            (cls.alice, "4.20", date(2023, 9, 30), False),
+            (cls.bob, "-2.00", date(2023, 9, 12), False),
+            (cls.alice, "0.10", date(2023, 10, 1), False),
+            (cls.alice, "0.20", date(2023, 10, 20), False),
+            (cls.bob, "-0.30", date(2023, 10, 2), False),
+            # Soft deleted
+            (cls.alice, "-100.00", date(2023, 10, 3), True),
+            (cls.bob, "-2.00", date(2023, 11, 30), False),
+        ]
+        for entity_id, (user, amount, day, is_deleted) in enumerate(cls.lines, start=1):
+            Transaction.objects.create(
+                entity_id=entity_id,
+                user=user,
+                idDocument=entity_id,
+                provided_title="Cotisation",
+                amount=Decimal(amount),
+                date_event=day,
+                is_deleted=is_deleted,
+            )
+
+    def summed_ledger(self, day, user=None):
+        initial_amount = Decimal("5.10") if user in (None, self.alice) else 0
+        return initial_amount + sum(
+            Decimal(amount)
+            for line_user, amount, line_day, is_deleted in self.lines
+            if not is_deleted and line_day <= day and user in (None, line_user)
+        )
+
+    def test_balance_at(self):
+        for day in (
+            date(2023, 8, 31),
+            date(2023, 9, 12),
+            date(2023, 10, 1),
+            date(2023, 10, 2),
+            date(2023, 10, 31),
+            date(2024, 1, 1),
+        ):
+            for user in (None, self.alice, self.bob):
+                with self.subTest(day=day, user=user):
+                    balance = MonthlyBalance.objects.balance_at(
+                        day, user_id=user and user.pk
+                    )
+                    self.assertEqual(balance, self.summed_ledger(day, user))
+                    # Rounded to the cents, as in the JSON of the view
+                    self.assertEqual(balance.as_tuple().exponent, -2)
+
+        response = self.client.get(reverse("balance"), {"date": "2023-10-31"})
+        self.assertEqual(response.json()["balance"], "-2.80")
+
+    def test_history(self):
+        ends_of_months = [date(2023, 9, 30), date(2023, 10, 31), date(2023, 11, 30)]
+        for user in (None, self.alice, self.bob):
+            with self.subTest(user=user):
+                history = MonthlyBalance.objects.history(user_id=user and user.pk)
+                balances = [
+                    self.summed_ledger(day, user)
+                    for day in ends_of_months
+                    if user is not self.alice or day.month != 11
+                ]
+                self.assertEqual([month["balance"] for month in history], balances)
+                self.assertEqual(
+                    [str(month["amount"]) for month in history],
+                    [
+                        str(balance - previous)
+                        for balance, previous in zip(
+                            balances,
+                            [self.summed_ledger(date(2023, 8, 31), user)] + balances,
+                        )
+                    ],
+                )
+
+
+@override_settings(DEBT_MAIL_BATCH_SIZE=2, DEBT_MAIL_RETRY_DELAY=60)
+class DebtMailTests(TestCase):
+    """Reminders are queued by the view and sent in batches by the worker"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(f"member{number}@example.com").pk
+            for number in range(3)
+        ]
+        ProfileAC.objects.update(current_amount=Decimal("-20.00"))
+
+    def queue(self):
+        return self.client.post(
+            reverse("debt_mail_form"), {"users": self.users}, follow=True
+        )
+
+    def test_queue(self):
+        response = self.queue()
+        self.assertEqual(mail.outbox, [])
+        self.assertQuerysetEqual(
+            Reminder.objects.order_by("recipient"),
+            [(user, Decimal("-20.00"), "pending") for user in self.users],
+            transform=lambda reminder: (
+                reminder.recipient_id,
+                reminder.balance,
+                reminder.status,
+            ),
+        )
+        self.assertContains(response, "3 reminder(s) queued, 0 already queued")
+        # Until they are sent
+        response = self.queue()
+        self.assertContains(response, "0 reminder(s) queued, 3 already queued")
+        self.assertEqual(Reminder.objects.count(), 3)
+
+    def set_balances(self, *balances):
+        for user, balance in zip(self.users, balances):
+            ProfileAC.objects.filter(user=user).update(current_amount=Decimal(balance))
+
+    def test_select_all_matching(self):
+        self.set_balances("-5.00", "-20.00", "-60.00")
+        url = reverse("debt_mail_form")
+        # The recipients are read and the reminders written in one query each
+        with self.assertNumQueries(2):
+            self.client.post(url, {"all_matching": "on", "min_debt": "10"})
+        self.assertQuerysetEqual(
+            Reminder.objects.order_by("recipient"),
+            self.users[1:],
+            transform=lambda reminder: reminder.recipient_id,
+        )
+
+        response = self.client.post(
+            url, {"all_matching": "on", "max_debt": "50"}, follow=True
+        )
+        self.assertContains(response, "1 reminder(s) queued, 1 already queued")
+
+    def test_empty_selection(self):
+        response = self.client.post(reverse("debt_mail_form"), {})
+        self.assertContains(response, "Select at least one debtor.")
+        self.assertFalse(Reminder.objects.exists())
+
+    @mock.patch.object(SendDebtMailView, "paginate_by", 2)
+    def test_debtor_pages(self):
+        self.set_balances("-5.00", "-20.00", "-60.00")
+        url = reverse("debt_mail_form")
+        response = self.client.get(url)
+        self.assertEqual(response.context["matching_count"], 3)
+        self.assertEqual(
+            [debtor.pk for debtor in response.context["debtors"]],
+            [self.users[2], self.users[1]],
+        )
+        response = self.client.get(f"{url}?{response.context['next_query']}")
+        self.assertEqual(
+            [debtor.pk for debtor in response.context["debtors"]], [self.users[0]]
+        )
+        self.assertIsNone(response.context["next_query"])
+
+        response = self.client.get(url, {"q": "MEMBER1"})
+        self.assertEqual(
+            [debtor.pk for debtor in response.context["debtors"]], [self.users[1]]
+        )
+
+    def test_batches(self):
+        self.queue()
+        with mock.patch.object(
+            locmem.EmailBackend, "open", autospec=True, return_value=True
+        ) as open_connection:
+            reports = list(deliver_reminders())
+        self.assertEqual(open_connection.call_count, 2)
+        self.assertEqual([len(report.sent) for report in reports], [2, 1])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(Reminder.objects.exclude(status=Reminder.Status.SENT))
+        # Nothing is sent twice
+        self.assertEqual(list(deliver_reminders()), [])
+
+    def test_retry(self):
+        self.queue()
+        send_messages = locmem.EmailBackend.send_messages
+
+        def refuse_member1(backend, messages):
+            if messages[0].to == ["member1@example.com"]:
+                raise SMTPRecipientsRefused({"member1@example.com": (550, b"")})
+            return send_messages(backend, messages)
+
+        with mock.patch.object(
+            locmem.EmailBackend, "send_messages", refuse_member1
+        ), self.assertLogs("suivi_operations.mailing", "WARNING"):
+            list(deliver_reminders())
+            refused = Reminder.objects.get(recipient__email="member1@example.com")
+            self.assertEqual(refused.status, Reminder.Status.PENDING)
+            self.assertEqual(refused.attempts, 1)
+            self.assertGreater(
+                refused.next_attempt_at, timezone.now() + timedelta(seconds=50)
+            )
+
+            # Retried once due, then failed after the last attempt
+            Reminder.objects.filter(pk=refused.pk).update(
+                next_attempt_at=timezone.now()
+            )
+            with self.settings(DEBT_MAIL_MAX_ATTEMPTS=2):
+                list(deliver_reminders())
+        refused.refresh_from_db()
+        self.assertEqual(refused.status, Reminder.Status.FAILED)
+        self.assertEqual(refused.attempts, 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_unexpected_errors(self):
+        self.queue()
+        send_messages = locmem.EmailBackend.send_messages
+
+        def reject_member1(backend, messages):
+            if messages[0].to == ["member1@example.com"]:
+                raise ValueError("Invalid address")
+            return send_messages(backend, messages)
+
+        def fail_member2(user, *args):
+            if user.email == "member2@example.com":
+                raise TemplateSyntaxError("Broken template")
+            return debt_message(user, *args)
+
+        with mock.patch.object(
+            locmem.EmailBackend, "send_messages", reject_member1
+        ), mock.patch(
+            "suivi_operations.mailing.debt_message", fail_member2
+        ), self.assertLogs(
+            "suivi_operations.mailing", "WARNING"
+        ):
+            reports = list(deliver_reminders())
+        self.assertEqual(sum(len(report.failed) for report in reports), 2)
+        self.assertQuerysetEqual(
+            Reminder.objects.order_by("recipient"),
+            [("sent", 0), ("pending", 1), ("pending", 1)],
+            transform=lambda reminder: (reminder.status, reminder.attempts),
+        )
+        self.assertEqual(
+            Reminder.objects.get(recipient__email="member1@example.com").error,
+            "Invalid address",
+        )
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_collapsed_template(self):
+        user = User.objects.get(pk=self.users[0])
+        Transaction.objects.create(
+            entity_id=1,
+            user=user,
+            idDocument=1,
+            provided_title="Cotisation - Transaction #1",
+            amount=Decimal("-20.00"),
+            date_event=date(2023, 9, 1),
+        )
+        context = {"user": user, "date_check": date(2023, 9, 15)}
+        rendered = get_template(DEBT_TEMPLATE).render(context)
+        self.assertEqual(
+            load_debt_template().render(context),
+            re.sub(r"\s*\n\s*", " ", rendered).strip(),
+        )
+
+        # Line breaks within the values are kept
+        Transaction.objects.create(
+            entity_id=2,
+            user=user,
+            idDocument=2,
+            provided_title="Stage\nTransaction #2",
+            amount=Decimal("-10.00"),
+            date_event=date(2023, 9, 2),
+        )
+        rendered = load_debt_template().render(context)
+        self.assertIn("Stage\nTransaction #2", rendered)
+        self.assertEqual(rendered.count("\n"), 1)
+
+    @override_settings(DEBT_MAIL_RENDER_THREADS=2)
+    def test_render_threads(self):
+        self.queue()
+        # 5 by batch and the claim finding nothing more, none by the threads
+        with self.assertNumQueries(11):
+            reports = list(deliver_reminders())
+        self.assertEqual([len(report.sent) for report in reports], [2, 1])
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            [f"member{number}@example.com" for number in range(3)],
+        )
+
+    @mock.patch("suivi_operations.mailing.time")
+    def test_rate_limiter(self, mock_time):
+        mock_time.monotonic.return_value = 100
+        rate_limiter = RateLimiter(120)
+        rate_limiter.wait()
+        mock_time.sleep.assert_not_called()
+        rate_limiter.wait()
+        mock_time.sleep.assert_called_once_with(0.5)
+
+
+class ReminderCampaignTests(TestCase):
+    """Campaign recipients are computed in one query, whatever the club size"""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.members = {}
+        for name, balance, reminded_days_ago, paid_since in (
+            ("never_reminded", "-20.00", None, False),
+            ("small_debt", "-5.00", None, False),
+            ("reminded_recently", "-20.00", 5, False),
+            ("reminded_long_ago", "-20.00", 60, False),
+            ("paid_since", "-20.00", 60, True),
+            ("creditor", "15.00", None, False),
+        ):
+            user = User.objects.create_user(f"{name}@example.com")
+            ProfileAC.objects.filter(user=user).update(current_amount=Decimal(balance))
+            if reminded_days_ago is not None:
+                Reminder.objects.create(
+                    datetime=now - timedelta(days=reminded_days_ago),
+                    subject="Rappel",
+                    recipient=user,
+                    balance=Decimal(balance),
+                    status=Reminder.Status.SENT,
+                )
+            if paid_since:
+                Transaction.objects.create(
+                    entity_id=user.pk,
+                    user=user,
+                    idDocument=user.pk,
+                    provided_title="Paiement",
+                    amount=Decimal("10.00"),
+                    date_event=(now - timedelta(days=10)).date(),
+                )
+            cls.members[name] = user
+
+    def recipients(self, **options):
+        options = {"min_debt": Decimal("10"), "min_days": 30, **options}
+        return sorted(
+            user.email.split("@")[0]
+            for user in Reminder.objects.campaign_recipients(**options)
+        )
+
+    def test_recipients(self):
+        self.assertEqual(self.recipients(), ["never_reminded", "reminded_long_ago"])
+        self.assertEqual(
+            self.recipients(exclude_recent_payers=False),
+            ["never_reminded", "paid_since", "reminded_long_ago"],
+        )
+        self.assertEqual(
+            self.recipients(min_debt=Decimal("0"), min_days=0),
+            ["never_reminded", "reminded_long_ago", "reminded_recently", "small_debt"],
+        )
+
+    def test_preview(self):
+        url = reverse("reminder_campaign")
+        data = {
+            "min_debt": "10",
+            "min_days": "30",
+            "exclude_recent_payers": "on",
+            "preview": "Aperçu",
+        }
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(url, data)
+        self.assertEqual(response.context["preview"]["count"], 2)
+        self.assertFalse(Reminder.objects.filter(status=Reminder.Status.PENDING))
+
+        for number in range(20):
+            user = User.objects.create_user(f"debtor{number}@example.com")
+            ProfileAC.objects.filter(user=user).update(current_amount=-50)
+        with self.assertNumQueries(len(captured)):
+            response = self.client.post(url, data)
+        self.assertEqual(response.context["preview"]["count"], 22)
+
+    def test_send(self):
+        url = reverse("reminder_campaign")
+        data = {"min_debt": "10", "min_days": "30", "exclude_recent_payers": "on"}
+        response = self.client.post(url, data, follow=True)
+        self.assertContains(response, "2 reminder(s) queued, 0 already queued")
+        self.assertEqual(
+            set(
+                Reminder.objects.filter(status=Reminder.Status.PENDING).values_list(
+                    "recipient", flat=True
+                )
+            ),
+            {self.members["never_reminded"].pk, self.members["reminded_long_ago"].pk},
+        )
+        # Just reminded
+        response = self.client.post(url, data, follow=True)
+        self.assertContains(response, "0 reminder(s) queued, 0 already queued")
+
+
+def ledger_row(entity_id, name, amount, title="Cotisation"):
+    """Return a line of the AssoConnect ledger export"""
+    return {
+        "entity_id": str(entity_id),
+        "user_id": f"411{entity_id} - {name}",
+        "Id pièce": str(entity_id),
+        "Intitulé": title,
+        "Crédit (EUR)": amount if not amount.startswith("-") else "",
+        "Débit (EUR)": amount[1:] if amount.startswith("-") else "",
+        "Date": "01/10/2023",
+    }
+
+
+class UserNameResolverTests(SimpleTestCase):
+    """Ledger labels are matched to the member names, loosely"""
+
+    def setUp(self):
+        self.users = {
+            name: User(
+                pk=pk, email=f"user{pk}@example.com", first_name=first, last_name=last
+            )
+            for pk, (name, first, last) in enumerate(
+                (
+                    ("elodie", "Élodie", "d'Argent"),
+                    ("jean", "Jean-Pierre", "Martin-Durand"),
+                    ("jean_de_la_fontaine", "Jean", "De La Fontaine"),
+                    ("alice", "Alice", "Martin"),
+                    ("other_alice", "ALICE", "martin"),
+                ),
+                start=1,
+            )
+        }
+        self.resolver = UserNameResolver(self.users.values())
+
+    def test_folding(self):
+        for label, name in (
+            ("4111 - ELODIE D ARGENT", "elodie"),
+            ("4111 - élodie  d’argent", "elodie"),
+            ("4112 - Jean-Pierre Martin-Durand", "jean"),
+            ("4112 - jean pierre martin durand", "jean"),
+            # First name starting with the first word, last name ending with
+            # the last one
+            ("4112 - Jean Durand", "jean"),
+            ("4113 - Jean de la Fontaine", "jean_de_la_fontaine"),
+            ("4113 - Jean Fontaine", "jean_de_la_fontaine"),
+        ):
+            with self.subTest(label):
+                self.assertEqual(self.resolver.resolve(label), self.users[name])
+        self.assertFalse(self.resolver.report)
+
+    def test_reports(self):
+        for label in ("4114 - Alice Martin", "4115 - Nobody", "4115 - Nobody"):
+            self.assertIsNone(self.resolver.resolve(label))
+        self.assertEqual(
+            self.resolver.report.ambiguous,
+            {
+                "4114 - Alice Martin": [
+                    self.users["alice"],
+                    self.users["other_alice"],
+                ]
+            },
+        )
+        self.assertEqual(self.resolver.report.unmatched, {"4115 - Nobody": 2})
+
+
+class TransactionSyncTests(TestCase):
+    """Imports only write the lines which differ from the export"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = User.objects.create_user("alice@example.com")
+        cls.member.first_name, cls.member.last_name = "Alice", "Martin"
+        cls.member.save()
+
+    def run_import(self, rows):
+        return TransactionImporter().run(rows)
+
+    def ledger(self):
+        return {
+            entity_id: (amount, is_deleted)
+            for entity_id, amount, is_deleted in Transaction.objects.values_list(
+                "entity_id", "amount", "is_deleted"
+            )
+        }
+
+    def test_sync(self):
+        counts = self.run_import(
+            [
+                ledger_row(1, "Alice Martin", "10,00"),
+                ledger_row(2, "Alice Martin", "-5,00"),
+                ledger_row(3, "Alice Martin", "-7,00"),
+            ]
+        )
+        self.assertEqual(counts["transactions_added"], 3)
+        stored = dict(Transaction.objects.values_list("entity_id", "last_update"))
+
+        # 1 unchanged, 2 changed, 3 missing, 4 new
+        counts = self.run_import(
+            [
+                ledger_row(1, "Alice Martin", "10,00"),
+                ledger_row(2, "Alice Martin", "-6,00"),
+                ledger_row(4, "Alice Martin", "-1,00"),
+            ]
+        )
+        self.assertEqual(counts["transactions_added"], 1)
+        self.assertEqual(
+            self.ledger(),
+            {
+                1: (Decimal("10.00"), False),
+                2: (Decimal("-6.00"), False),
+                3: (Decimal("-7.00"), True),
+                4: (Decimal("-1.00"), False),
+            },
+        )
+        self.assertEqual(Transaction.objects.get(pk=1).last_update, stored[1])
+        self.assertGreater(Transaction.objects.get(pk=2).last_update, stored[2])
+        self.assertEqual(
+            ProfileAC.objects.get(user=self.member).transactions_amount,
+            Decimal("3.00"),
+        )
+
+        # Back in the export
+        self.run_import([ledger_row(3, "Alice Martin", "-7,00")])
+        self.assertEqual(self.ledger()[3], (Decimal("-7.00"), False))
+        self.assertEqual(
+            ProfileAC.objects.get(user=self.member).transactions_amount,
+            Decimal("-7.00"),
+        )
+
+    def test_identical_import(self):
+        rows = [ledger_row(number, "Alice Martin", "-5,00") for number in range(1, 6)]
+        self.run_import(rows)
+        with CaptureQueriesContext(connection) as captured:
+            self.run_import(rows)
+        # Neither the ledger nor the totals derived from it are written
+        writes = [
+            query["sql"]
+            for query in captured
+            if re.match(
+                r'(INSERT INTO|UPDATE|DELETE FROM) "suivi_operations_'
+                r'(transaction|profileac|monthlybalance)"',
+                query["sql"],
+            )
+        ]
+        self.assertEqual(writes, [])
+
+    def test_ambiguous_label(self):
+        namesake = User.objects.create_user("alice.martin@example.com")
+        namesake.first_name, namesake.last_name = "Alice", "Martin"
+        namesake.save()
+        counts = self.run_import(
+            [
+                ledger_row(1, "Alice Martin", "10,00"),
+                ledger_row(2, "Unknown Member", "10,00"),
+            ]
+        )
+        # The lines are left out, the rest of the file is imported
+        self.assertEqual(counts["transactions_added"], 0)
+        self.assertEqual(counts["ambiguous"], ["4111 - Alice Martin"])
+        self.assertEqual(counts["unmatched"], ["4112 - Unknown Member"])
+
+    def test_edited_line_is_restored(self):
+        rows = [ledger_row(1, "Alice Martin", "10,00")]
+        self.run_import(rows)
+        line = Transaction.objects.get(pk=1)
+        line.amount = Decimal("99.00")
+        line.save()
+
+        self.run_import(rows)
+        line.refresh_from_db()
+        self.assertEqual(line.amount, Decimal("10.00"))
+        self.assertEqual(line.fingerprint, line.content_fingerprint())
+
+
+class StagedTransactionSyncTests(TransactionSyncTests):
+    """The staged imports publish the same changes"""
+
+    def run_import(self, rows):
+        job = ImportJob.objects.create(
+            category=ImportJob.Category.TRANSACTION_LIST, file="imports/ledger.json"
+        )
+        return StagedTransactionImporter(job).run(rows)
+
+
+class StagedImportTests(TestCase):
+    """The ledger is published at once, after the whole file is staged"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.members = []
+        for first_name, last_name in (("Alice", "Martin"), ("Bob", "Durand")):
+            user = User.objects.create_user(f"{first_name.lower()}@example.com")
+            user.first_name, user.last_name = first_name, last_name
+            user.save()
+            cls.members.append(user)
+        alice, bob = cls.members
+        for entity_id, user, amount in ((1, alice, "10.00"), (2, bob, "-5.00")):
+            Transaction.objects.create(
+                entity_id=entity_id,
+                user=user,
+                idDocument=entity_id,
+                provided_title="Cotisation",
+                amount=Decimal(amount),
+                date_event=date(2023, 9, 1),
+            )
+        ProfileAC.objects.refresh_transaction_totals()
+        # The balances of the new export
+        ProfileAC.objects.filter(user=alice).update(current_amount=Decimal("20.00"))
+        ProfileAC.objects.filter(user=bob).update(current_amount=Decimal("-30.00"))
+
+    def setUp(self):
+        self.job = ImportJob.objects.create(
+            category=ImportJob.Category.TRANSACTION_LIST, file="imports/ledger.json"
+        )
+        # Alice's line is modified, Bob's replaced by a new one
+        self.rows = [
+            ledger_row(1, "Alice Martin", "20,00"),
+            ledger_row(3, "Bob Durand", "-30,00"),
+        ]
+
+    def ledger(self):
+        return dict(
+            Transaction.objects.filter(is_deleted=False).values_list(
+                "entity_id", "amount"
+            )
+        )
+
+    def test_publish(self):
+        ledgers = []
+
+        def on_progress(importer):
+            if importer.phase == "staging":
+                ledgers.append(self.ledger())
+
+        importer = StagedTransactionImporter(
+            self.job, on_progress=on_progress, commit_rows=1
+        )
+        counts = importer.run(self.rows)
+
+        former_ledger = {1: Decimal("10.00"), 2: Decimal("-5.00")}
+        self.assertTrue(ledgers)
+        for ledger in ledgers:
+            self.assertEqual(ledger, former_ledger)
+        self.assertEqual(self.ledger(), {1: Decimal("20.00"), 3: Decimal("-30.00")})
+        self.assertTrue(Transaction.objects.get(pk=2).is_deleted)
+        self.assertEqual(counts["transactions_added"], 1)
+        self.assertEqual(
+            (counts["discrepancies_before"], counts["discrepancies_after"]), (2, 0)
+        )
+        self.assertFalse(StagedTransaction.objects.exists())
+        self.assertEqual(
+            list(
+                ProfileAC.objects.order_by("user").values_list("diff_amount", flat=True)
+            ),
+            [0, 0],
+        )
+
+    def reconcile_former_ledger(self, *imports):
+        """Make the balances agree with the former ledger, imported by imports
+
+        imports are the categories of the previous import jobs, oldest first.
+        """
+        ProfileAC.objects.filter(user=self.members[0]).update(
+            current_amount=Decimal("10.00"), diff_amount=0
+        )
+        ProfileAC.objects.filter(user=self.members[1]).update(
+            current_amount=Decimal("-5.00"), diff_amount=0
+        )
+        now = timezone.now()
+        for days_ago, category in enumerate(reversed(imports), start=1):
+            ImportJob.objects.create(
+                category=category,
+                file="imports/previous",
+                status=ImportJob.Status.SUCCEEDED,
+                finished_at=now - timedelta(days=days_ago),
+            )
+
+    def test_truncated_export(self):
+        self.reconcile_former_ledger(
+            ImportJob.Category.TRANSACTION_LIST, ImportJob.Category.BALANCES_LIST
+        )
+        importer = StagedTransactionImporter(self.job, max_new_discrepancies=0)
+        # Bob's line is missing
+        with self.assertRaises(LedgerValidationError):
+            importer.run([ledger_row(1, "Alice Martin", "10,00")])
+        self.assertEqual(self.ledger(), {1: Decimal("10.00"), 2: Decimal("-5.00")})
+
+    def test_ledger_before_balances(self):
+        # The new ledger is imported before the balances describing it
+        self.reconcile_former_ledger(
+            ImportJob.Category.BALANCES_LIST, ImportJob.Category.TRANSACTION_LIST
+        )
+        rows = [
+            ledger_row(1, "Alice Martin", "10,00"),
+            ledger_row(2, "Bob Durand", "-5,00"),
+            ledger_row(3, "Alice Martin", "5,00"),
+            ledger_row(4, "Bob Durand", "-5,00"),
+        ]
+        importer = StagedTransactionImporter(self.job, max_new_discrepancies=0)
+        counts = importer.run(rows)
+        self.assertEqual(len(self.ledger()), 4)
+        self.assertEqual(
+            (counts["discrepancies_before"], counts["discrepancies_after"]), (0, 2)
+        )
+
+        # Without a limit, the discrepancies are only reported
+        ImportJob.objects.filter(category=ImportJob.Category.BALANCES_LIST).update(
+            finished_at=timezone.now()
+        )
+        job = ImportJob.objects.create(
+            category=ImportJob.Category.TRANSACTION_LIST, file="imports/ledger.json"
+        )
+        counts = StagedTransactionImporter(job).run(rows[:1])
+        self.assertEqual(self.ledger(), {1: Decimal("10.00")})
+        self.assertEqual(counts["discrepancies_after"], 1)
+
+    def test_resume(self):
+        def on_progress(importer):
+            if importer.rows_processed == 2:
+                raise RuntimeError("Interrupted")
+
+        importer = StagedTransactionImporter(
+            self.job, on_progress=on_progress, commit_rows=1
+        )
+        with self.assertRaises(RuntimeError):
+            importer.run(self.rows)
+        self.assertEqual(self.job.staged_transactions.count(), 1)
+
+        importer = StagedTransactionImporter(self.job, commit_rows=1)
+        importer.run(self.rows, start_row=1)
+        self.assertEqual(self.ledger(), {1: Decimal("20.00"), 3: Decimal("-30.00")})
+
+
+def members_csv(*emails):
+    """Return a members export listing the given emails"""
+    lines = ["Email,Prénom,Nom,ID du Contact"]
+    lines += [
+        f"{email},{email.split('@')[0]},Martin,{7000000 + number}"
+        for number, email in enumerate(emails)
+    ]
+    return ContentFile("\r\n".join(lines).encode(), name="members.csv")
+
+
+def member_row(email, id_contact="", last_name="Martin"):
+    """Return a line of the AssoConnect members export"""
+    return {
+        "Email": email,
+        "Prénom": email.split("@")[0],
+        "Nom": last_name,
+        "ID du Contact": str(id_contact),
+        "Statut adhérent": "Adhérent",
+        "Membre annuels (aides CS)": "",
+    }
+
+
+@override_settings(IMPORT_PARSE_WORKERS=0)
+class MemberImportTests(TestCase):
+    """Members are written in bulk, their profiles without the signals"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.existing = User.objects.create_user("existing@example.com")
+        cls.existing.is_active = True
+        cls.existing.save()
+        ProfileAC.objects.filter(user=cls.existing).update(idContact=7000001)
+
+    def contacts(self):
+        return dict(ProfileAC.objects.values_list("user__email", "idContact"))
+
+    def test_members(self):
+        counts = MemberImporter().run(
+            [
+                member_row("existing@example.com", 7000001, last_name="Durand"),
+                member_row("new@example.com", 7000002),
+                member_row("invalid-email", 7000003),
+            ]
+        )
+        self.assertEqual(counts["members_added"], 1)
+        self.assertQuerysetEqual(
+            User.objects.order_by("email"),
+            [
+                ("existing@example.com", "Durand", True),
+                ("new@example.com", "Martin", False),
+            ],
+            transform=lambda user: (user.email, user.last_name, user.is_active),
+        )
+        self.assertEqual(
+            self.contacts(),
+            {"existing@example.com": 7000001, "new@example.com": 7000002},
+        )
+        self.assertTrue(
+            ProfileAC.objects.get(user__email="new@example.com").member_revo
+        )
+
+    def test_duplicate_contact_ids(self):
+        MemberImporter().run(
+            [
+                # Owned by an existing profile
+                member_row("first@example.com", 7000001),
+                # Twice in the same batch
+                member_row("second@example.com", 7000002),
+                member_row("third@example.com", 7000002),
+            ]
+        )
+        contacts = self.contacts()
+        self.assertEqual(contacts["existing@example.com"], 7000001)
+        self.assertIsNone(contacts["first@example.com"])
+        # Only one of them gets it
+        self.assertCountEqual(
+            [contacts["second@example.com"], contacts["third@example.com"]],
+            [7000002, None],
+        )
+
+    def test_queries(self):
+        def count_queries(emails):
+            rows = [member_row(email) for email in emails]
+            with CaptureQueriesContext(connection) as captured:
+                MemberImporter().run(rows)
+            return len(captured)
+
+        few = count_queries([f"few{number}@example.com" for number in range(3)])
+        many = count_queries([f"many{number}@example.com" for number in range(60)])
+        self.assertEqual(few, many)
+
+
+def balance_row(id_contact, initial_amount, current_amount):
+    """Return a line of the AssoConnect balances export, seen from the club"""
+    return {
+        "ID": str(id_contact),
+        "Solde en début de période (EUR)": initial_amount,
+        "Solde à la date T (EUR)": current_amount,
+    }
+
+
+@override_settings(IMPORT_PARSE_WORKERS=0)
+class BalanceImportTests(TestCase):
+    """The balances are written at the end of the file, in one statement"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for id_contact in (7000001, 7000002, 7993922):
+            user = User.objects.create_user(f"member{id_contact}@example.com")
+            ProfileAC.objects.filter(user=user).update(
+                idContact=id_contact, transactions_amount=Decimal("-10.00")
+            )
+
+    def balances(self):
+        return {
+            id_contact: (initial_amount, current_amount, diff_amount)
+            for id_contact, initial_amount, current_amount, diff_amount in (
+                ProfileAC.objects.values_list(
+                    "idContact", "initial_amount", "current_amount", "diff_amount"
+                )
+            )
+        }
+
+    def test_balances(self):
+        with CaptureQueriesContext(connection) as captured:
+            counts = BalanceImporter().run(
+                [
+                    balance_row(7000001, "5,00", "15,00"),
+                    balance_row(7000002, "0,00", "1\u202f000,00"),
+                    # Excluded contact
+                    balance_row(7993922, "0,00", "50,00"),
+                    balance_row(7000009, "0,00", "20,00"),
+                    balance_row("", "0,00", "20,00"),
+                ]
+            )
+        self.assertEqual(counts["balances_updated"], 2)
+        self.assertEqual(counts["unknown_contacts"], [7000009])
+        self.assertEqual(
+            self.balances(),
+            {
+                # The export is seen from the club: debts are positive
+                7000001: (Decimal("-5.00"), Decimal("-15.00"), 0),
+                7000002: (0, Decimal("-1000.00"), Decimal("-990.00")),
+                7993922: (None, None, None),
+            },
+        )
+        updates = [
+            query
+            for query in captured
+            if query["sql"].startswith('UPDATE "suivi_operations_profileac"')
+        ]
+        self.assertEqual(len(updates), 1)
+
+    def test_queries(self):
+        def count_queries(rows):
+            with CaptureQueriesContext(connection) as captured:
+                BalanceImporter().run(rows)
+            return len(captured)
+
+        few = count_queries([balance_row(7000001, "0,00", "1,00")])
+        for number in range(30):
+            user = User.objects.create_user(f"other{number}@example.com")
+            ProfileAC.objects.filter(user=user).update(idContact=7100000 + number)
+        many = count_queries(
+            [balance_row(7100000 + number, "0,00", "1,00") for number in range(30)]
+        )
+        self.assertEqual(few, many)
+
+
+@override_settings(IMPORT_COMMIT_ROWS=2, IMPORT_PARSE_WORKERS=0)
+class ImportJobTests(TestCase):
+    """Interrupted jobs resume from the last committed chunk"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.emails = [f"member{number}@example.com" for number in range(5)]
+        self.job = ImportJob.objects.create(
+            category=ImportJob.Category.MEMBER_LIST, file=members_csv(*self.emails)
+        )
+
+    def run_until_killed(self, chunks):
+        """Run the job and kill its worker once chunks are committed"""
+        write = MemberImporter.write
+        written = []
+
+        def killed_write(importer, records):
+            if len(written) == chunks:
+                raise KeyboardInterrupt
+            written.append([email for email, values in records])
+            return write(importer, records)
+
+        job = claim_import_job()
+        with mock.patch.object(MemberImporter, "write", killed_write):
+            with self.assertRaises(KeyboardInterrupt):
+                run_import_job(job)
+        return written
+
+    def resume(self):
+        write = MemberImporter.write
+        written = []
+
+        def recorded_write(importer, records):
+            written.append([email for email, values in records])
+            return write(importer, records)
+
+        # The worker died, the job is claimed again once timed out
+        ImportJob.objects.filter(pk=self.job.pk).update(
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+        job = claim_import_job()
+        self.assertEqual(job.pk, self.job.pk)
+        with mock.patch.object(MemberImporter, "write", recorded_write):
+            run_import_job(job)
+        self.assertEqual(job.status, ImportJob.Status.SUCCEEDED)
+        return job, written
+
+    def test_resume(self):
+        self.assertEqual(self.run_until_killed(chunks=1), [self.emails[:2]])
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, ImportJob.Status.RUNNING)
+        self.assertEqual(self.job.rows_processed, 2)
+
+        job, written = self.resume()
+        self.assertEqual(written, [self.emails[2:4], self.emails[4:]])
+        self.assertEqual(job.rows_processed, 5)
+        self.assertEqual(job.counts["members_added"], 5)
+        self.assertEqual(
+            sorted(User.objects.values_list("email", flat=True)), self.emails
+        )
+
+    def test_other_file(self):
+        self.run_until_killed(chunks=2)
+        # The file was replaced in the meantime, its rows are all imported
+        self.job.refresh_from_db()
+        self.job.file.delete(save=False)
+        self.job.file = members_csv("other@example.com")
+        self.job.save()
+
+        job, written = self.resume()
+        self.assertEqual(written, [["other@example.com"]])
+        self.assertEqual(job.rows_processed, 1)
+        self.assertEqual(job.counts["members_added"], 1)
+
+
+class ImportFileViewTests(TestCase):
+    """Uploaded files are queued, their job is then polled by the import page"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def test_enqueue_and_poll(self):
+        file = members_csv("alice@example.com", "bob@example.com")
+        response = self.client.post(
+            reverse("import_file"),
+            {"category": ImportJob.Category.MEMBER_LIST, "file": file},
+        )
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, f"{reverse('import_file')}?job={job.pk}")
+        self.assertEqual(job.status, ImportJob.Status.PENDING)
+        # Nothing is imported until a worker runs the job
+        self.assertFalse(User.objects.exists())
+
+        status_url = reverse("import_job_status", args=[job.pk])
+        status = self.client.get(status_url).json()
+        self.assertEqual(status["status"], ImportJob.Status.PENDING)
+        self.assertEqual(status["phase"], "queued")
+
+        job = claim_import_job()
+        run_import_job(job)
+
+        status = self.client.get(status_url).json()
+        self.assertEqual(status["status"], ImportJob.Status.SUCCEEDED)
+        self.assertEqual(status["phase"], job.phase)
+        self.assertEqual(status["rows_processed"], 2)
+        self.assertIsInstance(status["rows_per_second"], float)
+        self.assertEqual(status["summary"], "Imported successfully (2 member(s) added)")
+
+        response = self.client.get(reverse("import_file"), {"job": job.pk})
+        self.assertEqual(response.context["job"], job)
+        self.assertEqual(
+            self.client.get(reverse("import_job_status", args=[0])).status_code, 404
+        )
+
+
+class ParseWorkersTests(TestCase):
+    """Rows parsed by a pool of processes are imported as by the worker alone"""
+
+    batch_size = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        for first_name, last_name in (("Alice", "Martin"), ("Bob", "Durand")):
+            user = User.objects.create_user(f"{first_name.lower()}@example.com")
+            user.first_name, user.last_name = first_name, last_name
+            user.save()
+
+    def run_import(self, importer_class, rows, parse_workers):
+        """Return the counts and the records written batch by batch"""
+        write = importer_class.write
+        exit_stage = ParseStage.__exit__
+        written = []
+        stages = []
+
+        def recorded_write(importer, records):
+            written.append(records)
+            return write(importer, records)
+
+        def recorded_exit(stage, *exc_info):
+            stages.append(stage)
+            return exit_stage(stage, *exc_info)
+
+        importer = importer_class(parse_workers=parse_workers)
+        with mock.patch.object(
+            importer_class, "write", recorded_write
+        ), mock.patch.object(
+            importer_class, "batch_size", self.batch_size
+        ), mock.patch.object(
+            ParseStage, "__exit__", recorded_exit
+        ):
+            counts = importer.run(rows)
+
+        if parse_workers:
+            # The pool is shut down with the import
+            with self.assertRaises(RuntimeError):
+                stages[0].executor.submit(print)
+        else:
+            self.assertIsNone(stages[0].executor)
+        return counts, written
+
+    def test_members(self):
+        rows = [
+            member_row(f"member{number}@example.com")
+            if number % 10
+            else member_row("invalid-email")
+            for number in range(40)
+        ]
+        parallel = self.run_import(MemberImporter, rows, parse_workers=2)
+        User.objects.filter(email__startswith="member").delete()
+        serial = self.run_import(MemberImporter, rows, parse_workers=0)
+        self.assertEqual(parallel, serial)
+
+        counts, written = parallel
+        self.assertEqual(counts["members_added"], 36)
+        self.assertEqual(
+            [email for records in written for email, values in records],
+            [row["Email"] for row in rows if row["Email"] != "invalid-email"],
+        )
+        self.assertEqual(len(written), 40 // self.batch_size + 1)
+
+    def test_transactions(self):
+        rows = [
+            ledger_row(
+                number,
+                ("Alice Martin", "Bob Durand", "Nobody Known")[number % 3],
+                f"{number},50",
+            )
+            for number in range(1, 31)
+        ]
+        parallel = self.run_import(TransactionImporter, rows, parse_workers=2)
+        ledger = list(Transaction.objects.order_by("pk").values())
+        Transaction.objects.all().delete()
+        serial = self.run_import(TransactionImporter, rows, parse_workers=0)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(
+            [
+                {**line, "last_update": None, "imported_date": None}
+                for line in Transaction.objects.order_by("pk").values()
+            ],
+            [{**line, "last_update": None, "imported_date": None} for line in ledger],
+        )
+
+        counts, written = parallel
+        self.assertEqual(counts["transactions_added"], 20)
+        self.assertEqual(len(counts["unmatched"]), 10)
+        self.assertEqual(
+            [entity_id for records in written for entity_id, *record in records],
+            list(range(1, 31)),
+        )
+
+
+class ParserTests(SimpleTestCase):
+    """Values of the exports, parsed through bounded caches"""
+
+    def setUp(self):
+        for parser in (parse_amount, parse_day_first_date, parse_month_first_date):
+            parser.cache_clear()
+
+    def test_amount(self):
+        for value, amount in (
+            ("12,5", "12.50"),
+            ("1\u202f234,56", "1234.56"),
+            ("1\xa0234,56", "1234.56"),
+            ("-1\u202f234,5", "-1234.50"),
+            ("-0,10", "-0.10"),
+            ("7", "7.00"),
+        ):
+            with self.subTest(value=value):
+                self.assertEqual(str(parse_amount(value)), amount)
+
+    def test_rounding(self):
+        # Ties go to the even cent, whatever the context of the caller
+        with localcontext(rounding=ROUND_HALF_UP):
+            self.assertEqual(parse_amount("0,125"), Decimal("0.12"))
+            self.assertEqual(parse_amount("-0,125"), Decimal("-0.12"))
+        self.assertEqual(parse_amount("0,135"), Decimal("0.14"))
+        self.assertEqual(parse_amount("0,1251"), Decimal("0.13"))
+        self.assertEqual(parse_amount("0,125"), Decimal("0.12"))
+
+    def test_invalid(self):
+        # Raised as by the uncached parsing, failing the import job
+        for value in ("", "12,5O", "1.234,56", "EUR"):
+            with self.subTest(value=value), self.assertRaises(InvalidOperation):
+                parse_amount(value)
+        for value in ("", "31/02/2023", "2023-09-01", "01/09"):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_day_first_date(value)
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_month_first_date(value)
+
+    def test_cache(self):
+        self.assertEqual(parse_amount("10,00"), Decimal("10.00"))
+        self.assertEqual(parse_amount("-10,00"), Decimal("-10.00"))
+        self.assertEqual(parse_amount("10,00"), Decimal("10.00"))
+        self.assertEqual(parse_amount.cache_info().hits, 1)
+        self.assertEqual(parse_amount.cache_info().misses, 2)
+
+        # The same value, read day first or month first
+        self.assertEqual(parse_day_first_date("02/03/2023"), date(2023, 3, 2))
+        self.assertEqual(parse_month_first_date("02/03/2023"), date(2023, 2, 3))
+        self.assertEqual(parse_day_first_date("02/03/2023"), date(2023, 3, 2))
+        self.assertEqual(parse_day_first_date("03/02/2023"), date(2023, 2, 3))
+
+
+class StreamTests(SimpleTestCase):
+    """Uploaded files are parsed incrementally, whatever the chunk boundaries"""
+
+    def json_items(self, content, chunk_size=1):
+        return list(
+            iter_json_items(ContentFile(content.encode()), chunk_size=chunk_size)
+        )
+
+    def test_json_items(self):
+        content = '[{"Intitulé": "Réglé ], { et ,", "amount": 12.5}, 345, "é"]'
+        expected = [{"Intitulé": "Réglé ], { et ,", "amount": 12.5}, 345, "é"]
+        for chunk_size in (1, 2, 3, 7, 1024):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.json_items(content, chunk_size), expected)
+        self.assertEqual(self.json_items("\ufeff [ ] \n"), [])
+
+    def test_malformed_json(self):
+        for content in (
+            "",
+            "{}",
+            "[1,,2]",
+            "[,1]",
+            "[1,]",
+            "[1 2]",
+            "[1, 2",
+            '[{"a": 1]',
+            "[1] 2",
+            "[1][2]",
+        ):
+            with self.subTest(content=content), self.assertRaises(json.JSONDecodeError):
+                self.json_items(content)
+
+    def test_csv_rows(self):
+        content = '\ufeffEmail,Nom\r\n"a@example.com","Martin\nDurand"\r\nb@example.com,Été\r\n'
+        file = ContentFile(content.encode())
+        self.assertEqual(read_csv_header(file, chunk_size=1), ["Email", "Nom"])
+        self.assertEqual(
+            list(iter_csv_rows(file, chunk_size=1)),
+            [
+                {"Email": "a@example.com", "Nom": "Martin\nDurand"},
+                {"Email": "b@example.com", "Nom": "Été"},
+            ],
+        )
+
+    def test_invalid_encoding(self):
+        with self.assertRaises(UnicodeDecodeError):
+            list(iter_lines(ContentFile(b"Email\n\xe9t\xe9\n")))
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite connection profile")
+class SQLiteProfileTests(SimpleTestCase):
+    """Readers aren't locked out of the database while an import writes"""
+
+    def setUp(self):
+        # The test database is in memory, where WAL doesn't apply
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_dict = {
+            **connection.settings_dict,
+            "NAME": os.path.join(directory.name, "profile.sqlite3"),
+        }
+
+    def connect(self, alias):
+        return DatabaseWrapper(self.settings_dict, alias)
+
+    def test_pragmas(self):
+        reader = self.connect("reader")
+        self.addCleanup(reader.close)
+        expected = {
+            "journal_mode": "wal",
+            "synchronous": 1,
+            "busy_timeout": settings.SQLITE_PRAGMAS["busy_timeout"],
+            "temp_store": 2,
+        }
+        with reader.cursor() as cursor:
+            for name, value in expected.items():
+                with self.subTest(name):
+                    cursor.execute(f"PRAGMA {name}")
+                    self.assertEqual(cursor.fetchone()[0], value)
+
+    def test_readers_during_import(self):
+        reader = self.connect("reader")
+        self.addCleanup(reader.close)
+        with reader.cursor() as cursor:
+            cursor.execute("CREATE TABLE ledger (id INTEGER PRIMARY KEY, amount)")
+            cursor.executemany("INSERT INTO ledger (amount) VALUES (%s)", [(1,)] * 1000)
+
+        writing = threading.Event()
+        read = threading.Event()
+
+        def run_import():
+            writer = self.connect("writer")
+            try:
+                with writer.cursor() as cursor:
+                    # The lock a large import takes once its changes spill
+                    # out of the page cache, and at commit time
+                    cursor.execute("BEGIN EXCLUSIVE")
+                    cursor.executemany(
+                        "INSERT INTO ledger (amount) VALUES (%s)", [(1,)] * 100000
+                    )
+                    writing.set()
+                    read.wait(10)
+                    cursor.execute("COMMIT")
+            finally:
+                writing.set()
+                writer.close()
+
+        thread = threading.Thread(target=run_import)
+        thread.start()
+        try:
+            self.assertTrue(writing.wait(10))
+            start = time.perf_counter()
+            with reader.cursor() as cursor:
+                for _ in range(20):
+                    cursor.execute("SELECT COUNT(*) FROM ledger")
+                    # The last committed ledger, not a half written one
+                    self.assertEqual(cursor.fetchone()[0], 1000)
+            self.assertLess(time.perf_counter() - start, 1)
+        finally:
+            read.set()
+            thread.join()
+
+        with reader.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM ledger")
+            self.assertEqual(cursor.fetchone()[0], 101000)
+
+
+@override_settings(REQUEST_PROFILING=True, REQUEST_PROFILING_REPEATED_QUERIES=5)
+class RequestProfilingTests(TestCase):
+    """Profiles of the requests, and their staff page"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser("staff@example.com")
+        cls.member = User.objects.create_user("member@example.com")
+
+    def setUp(self):
+        self.addCleanup(history._profiles.clear)
+
+    def profile(self, get_response):
+        """Return the profile of a request answered by get_response"""
+        middleware = RequestProfilingMiddleware(get_response)
+        with self.assertLogs("suivi_operations.profiling") as logs:
+            middleware(RequestFactory().get("/profiled"))
+        return logs.records[-1]
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            query_fingerprint('SELECT 1 FROM "t" WHERE "id" IN (%s, %s, %s)'),
+            query_fingerprint('SELECT 1 FROM "t" WHERE "id" IN (%s, %s)'),
+        )
+        self.assertEqual(
+            query_fingerprint('INSERT INTO "t" VALUES (%s, %s), (%s, %s)'),
+            'INSERT INTO "t" VALUES (%s, ...), ...',
+        )
+
+    def test_n_plus_one(self):
+        def get_response(request):
+            for user in User.objects.all():
+                # The same query for each member, with another parameter
+                ProfileAC.objects.filter(user=user).exists()
+            return HttpResponse()
+
+        User.objects.bulk_create(
+            User(email=f"member{number}@example.com") for number in range(3)
+        )
+        record = self.profile(get_response)
+        self.assertEqual(record.levelname, "WARNING")
+        profile = record.request_profile
+        self.assertTrue(profile["n_plus_one"])
+        self.assertEqual(profile["sql_count"], 6)
+        self.assertEqual(profile["repeated_queries"][0]["count"], 5)
+
+        record = self.profile(lambda request: HttpResponse(User.objects.count()))
+        self.assertEqual(record.levelname, "INFO")
+        self.assertFalse(record.request_profile["n_plus_one"])
+        self.assertEqual(record.request_profile["repeated_queries"], [])
+
+    def test_render_seconds(self):
+        self.client.force_login(self.staff)
+        with self.assertLogs("suivi_operations.profiling") as logs:
+            self.client.get(reverse("list_user"))
+        profile = logs.records[-1].request_profile
+        self.assertEqual(profile["path"], reverse("list_user"))
+        self.assertGreater(profile["render_seconds"], 0)
+        self.assertLess(profile["render_seconds"], profile["seconds"])
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestProfilingMiddleware(lambda request: HttpResponse())
+        with self.assertNoLogs("suivi_operations.profiling"):
+            self.client.get(reverse("list_user"))
+        self.assertEqual(history.slowest(), [])
+
+    def test_profile_list(self):
+        url = reverse("request_profiles")
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        self.client.get(reverse("list_user"))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # The slowest first, the page itself not being profiled yet
+        self.assertCountEqual(
+            [
+                (profile.path, profile.status_code)
+                for profile in response.context["profiles"]
+            ],
+            [(url, 302), (reverse("list_user"), 200)],
+        )
+        self.assertContains(response, reverse("list_user"))
@@ -3,6 +3,25 @@ from . import views
 
 urlpatterns = [
     path("import", views.ImportFileView.as_view(), name="import_file"),
+    path(
+        "import/<int:pk>/status",
+        views.ImportJobStatusView.as_view(),
+        name="import_job_status",
+    ),
     path("list", views.UserListView.as_view(), name="list_user"),
+    path("list/export", views.UserListExportView.as_view(), name="list_user_export"),
     path("debt", views.SendDebtMailView.as_view(), name="debt_mail_form"),
+    path(
+        "debt/campaign",
+        views.ReminderCampaignView.as_view(),
+        name="reminder_campaign",
+    ),
+    path("balance", views.BalanceView.as_view(), name="balance"),
+    path("history", views.BalanceHistoryView.as_view(), name="balance_history"),
+    path(
+        "users/<int:pk>/history",
+        views.BalanceHistoryView.as_view(),
+        name="user_balance_history",
+    ),
+    path("profiling", views.RequestProfileListView.as_view(), name="request_profiles"),
 ]
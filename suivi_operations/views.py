@@ -1,230 +1,413 @@
 import csv
-import io
-import re
+import hashlib
 import json
-from datetime import datetime
 from decimal import Decimal
 
-from django.db import transaction, IntegrityError
-from django.db.models import Sum, F
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.messages.views import SuccessMessageMixin
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _
+from django.views.generic.detail import BaseDetailView
+from django.views.generic.base import TemplateView, View
 from django.views.generic.edit import FormView
 from django.views.generic.list import ListView
-from django.core.exceptions import ValidationError
-from django.core.validators import validate_email
-from django.core.mail import EmailMessage
-from django.template.loader import get_template
 
-from .forms import ImportFileForm, SelectDebtUserForm
-from .models import User, Transaction
+from .forms import (
+    BalanceAtDateForm,
+    DebtorFilterForm,
+    ImportFileForm,
+    ReminderCampaignForm,
+    SelectDebtUserForm,
+    UserListFilterForm,
+)
+from .mailing import DEBT_SUBJECT
+from .models import (
+    DataGeneration,
+    ImportJob,
+    MonthlyBalance,
+    Reminder,
+    User,
+)
+from .parsers import TWO_PLACES
+from .profiling import history
 
 
 class ImportFileView(SuccessMessageMixin, FormView):
     form_class = ImportFileForm
     template_name = "suivi_operations/importfile.html"
-    success_url = "#"
-    success_message = _("Imported successfully")
+    success_message = _("Import queued")
 
     def form_valid(self, form):
-        file = form.cleaned_data["file"]
-
-        if form.cleaned_data["category"] == ImportFileForm.CategoryFile.MEMBER_LIST:
-            count_new_members = self._import_member_list_from_csv(file)
-            self.success_message += f" ({count_new_members} member(s) added)"
-        elif (
-            form.cleaned_data["category"]
-            == ImportFileForm.CategoryFile.TRANSACTION_LIST
-        ):
-            count_new_transactions = self._import_transactions_from_json(file)
-            self.success_message += f" ({count_new_transactions} transaction(s) added)"
-        elif form.cleaned_data["category"] == ImportFileForm.CategoryFile.BALANCES_LIST:
-            self._import_initial_current_amount_from_csv(file)
-            self.success_message += " (balances updated)"
+        # The import itself is run by the run_import_jobs command
+        self.job = ImportJob.objects.create(
+            category=form.cleaned_data["category"],
+            file=form.cleaned_data["file"],
+        )
         return super().form_valid(form)
 
-    @transaction.atomic
-    def _import_member_list_from_csv(self, file):
-        dictreader = csv.DictReader(io.StringIO(file))
+    def get_success_url(self):
+        return f"{reverse('import_file')}?job={self.job.pk}"
 
-        count_new_members = 0
-        for line in dictreader:
-            try:
-                validate_email(line["Email"].strip())
-            except ValidationError:
-                pass
-            else:
-                gender = line.get("Sexe")
-                if gender == "Masculin":
-                    gender = User.Gender.MEN
-                elif gender == "Féminin":
-                    gender = User.Gender.WOMEN
-                else:
-                    gender = User.Gender.UNSPECIFIED
-
-                user_values = {
-                    "first_name": line.get("Prénom"),
-                    "last_name": line.get("Nom"),
-                    "gender": gender,
-                    "phone_number": phone_number
-                    if (phone_number := line.get("Téléphone mobile")) != "0"
-                    else line.get("Téléphone mobile"),
-                    "date_of_birth": datetime.strptime(date_birth, "%m/%d/%Y")
-                    if (date_birth := line["Date de naissance"]) != "0"
-                    else None
-                    if line.get("Date de naissance")
-                    else None,
-                }
-
-                user, is_new = User.objects.update_or_create(
-                    email=line["Email"], defaults=user_values
-                )
-                if is_new:
-                    count_new_members += 1
-                    user.is_active = False
-
-                user.profile_ac.idContact = line.get("ID du Contact")
-                user.profile_ac.member_revo = (
-                    True
-                    if line.get("Statut adhérent")
-                    and re.match("Adhérent", line["Statut adhérent"])
-                    else False
-                )
-                user.profile_ac.member_CS = line.get("Membre annuels (aides CS)") != ""
-                user.profile_ac.detail_url = line.get("Détail")
-                user.profile_ac.last_check = datetime.today()
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        job_id = self.request.GET.get("job", "")
+        if job_id.isdigit():
+            context["job"] = ImportJob.objects.filter(pk=job_id).first()
+        return context
 
-                try:
-                    user.save()
-                except IntegrityError:
-                    pass
 
-        return count_new_members
+class ImportJobStatusView(BaseDetailView):
+    model = ImportJob
 
-    @staticmethod
-    def _amount_to_decimal(amount):
-        return round(Decimal(amount.replace(",", ".").replace("\u202f", "")), 2)
-
-    @transaction.atomic
-    def _import_transactions_from_json(self, json_file):
-        Transaction.objects.all().delete()
-
-        list = json.loads(json_file)
-        count_new_transactions = 0
-
-        for transaction_data in list:
-            if transaction_data["user_id"] in (
-                "7993922",
-                "8384240",
-                "8845003",
-                "8716849",
-            ):
-                continue
-
-            if transaction_data["Crédit (EUR)"]:
-                amount = self._amount_to_decimal(transaction_data["Crédit (EUR)"])
-            elif transaction_data["Débit (EUR)"]:
-                amount = -1 * self._amount_to_decimal(transaction_data["Débit (EUR)"])
-            else:
-                amount = None
-
-            user_name = transaction_data["user_id"].split(" - ")[-1]
-            user_name_parts = user_name.split(" ")
+    def render_to_response(self, context):
+        return JsonResponse(self.object.as_status())
+
+
+class KeysetPaginationMixin:
+    """Paginate a list from the last row shown rather than with an offset
+
+    The next page starts after the last row of the current one, so any page
+    costs an index range scan. Its position is signed in the "after" parameter,
+    with cursor_salt naming the list. get_sort returns the sort lookup, the
+    lookup breaking its ties, which must hold the primary key of the rows, and
+    whether the sort is descending.
+    """
+
+    cursor_salt = None
+
+    def get_sort(self):
+        raise NotImplementedError
+
+    def get_ordering(self):
+        lookup, tie_lookup, descending = self.get_sort()
+        if descending:
+            return [f"-{lookup}", f"-{tie_lookup}"]
+        return [lookup, tie_lookup]
+
+    def get_keyset_page(self, queryset, page_size):
+        """Return the rows of the requested page and the query of the next one"""
+        lookup, tie_lookup, descending = self.get_sort()
+        comparison = "lt" if descending else "gt"
+        sort_key = f"-{lookup}" if descending else lookup
+        # The cursor isn't part of the filter forms, changing filters restarts
+        # from the first page, as changing the sort the cursor was built for
+        cursor = None
+        if after := self.request.GET.get("after"):
             try:
-                user = User.objects.get(
-                    first_name__startswith=user_name_parts[0],
-                    last_name__endswith=user_name_parts[-1],
-                )
-            except User.DoesNotExist:
-                print(user_name)
-                continue
-
-            transaction_values = {
-                "user": user,
-                "idDocument": transaction_data["Id pièce"],
-                "provided_title": transaction_data["Intitulé"],
-                "amount": amount,
-                "date_event": datetime.strptime(transaction_data["Date"], "%d/%m/%Y"),
-                "is_deleted": False,
-            }
-            transaction, is_new = Transaction.objects.update_or_create(
-                entity_id=transaction_data["entity_id"], defaults=transaction_values
+                cursor = signing.loads(after, salt=self.cursor_salt)
+            except signing.BadSignature:
+                raise Http404(_("Invalid page"))
+        if cursor and cursor[0] == sort_key:
+            value, pk = cursor[1:]
+            queryset = queryset.filter(
+                Q(**{f"{lookup}__{comparison}e": value}),
+                Q(**{f"{lookup}__{comparison}": value})
+                | Q(**{f"{tie_lookup}__{comparison}": pk}),
             )
-            if is_new:
-                count_new_transactions += 1
-
-        return count_new_transactions
-
-    def _import_initial_current_amount_from_csv(self, file):
-        dictreader = csv.DictReader(io.StringIO(file))
-
-        for line in dictreader:
-            user_id = line.get("ID")
-            if user_id in (
-                "7993922",
-                "8384240",
-                "8845003",
-                "8716849",
-                "9114357",
-            ):
-                continue
-
-            if user_id and user_id.isdigit():
-                user = User.objects.get(profile_ac__idContact=line["ID"])
-                user.profile_ac.initial_amount = (-1) * self._amount_to_decimal(
-                    line.get("Solde en début de période (EUR)")
-                )
-                user.profile_ac.current_amount = (-1) * self._amount_to_decimal(
-                    line.get("Solde à la date T (EUR)")
-                )
-                user.save()
 
+        rows = list(queryset.order_by(*self.get_ordering())[: page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+
+        next_query = None
+        if has_next:
+            last_row = rows[-1]
+            value = last_row
+            for attribute in lookup.split("__"):
+                value = getattr(value, attribute)
+            query = self.request.GET.copy()
+            query["after"] = signing.dumps(
+                [sort_key, str(value), last_row.pk], salt=self.cursor_salt
+            )
+            next_query = query.urlencode()
+        return rows, next_query
+
+    def get_page_context(self, next_query):
+        first_query = self.request.GET.copy()
+        first_query.pop("after", None)
+        return {
+            "next_query": next_query,
+            "first_query": first_query.urlencode(),
+            "is_first_page": "after" not in self.request.GET,
+        }
 
-class UserListView(ListView):
+
+class UserListView(KeysetPaginationMixin, ListView):
     model = User
-    # paginate_by = 100
+    paginate_by = 100
+    cursor_salt = "user_list"
+    # Sort lookup and tie-breaker, matching the indexes of the models
+    sort_lookups = {
+        "diff_amount": ("profile_ac__diff_amount", "profile_ac__user"),
+        "current_amount": ("profile_ac__current_amount", "profile_ac__user"),
+        "last_name": ("last_name", "pk"),
+    }
+
+    def get(self, request, *args, **kwargs):
+        self.filter_form = UserListFilterForm(request.GET)
+        # Pages are cached until the next import changes the data
+        self.data_generation = DataGeneration.objects.current()
+        self.cache_timeout = getattr(settings, "RECONCILIATION_CACHE_TIMEOUT", 86400)
+        return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
-        queryset = User.objects.prefetch_related("profile_ac")
+        queryset = User.objects.select_related("profile_ac")
         queryset = queryset.filter(profile_ac__current_amount__isnull=False)
+        # Transaction totals are stored on the profiles by the imports
         queryset = queryset.annotate(
-            calculated_amount=Sum("transactions__amount", default=0)
-            + F("profile_ac__initial_amount"),
-            diff_amount=F("profile_ac__current_amount") - F("calculated_amount"),
+            # A missing initial balance counts as 0, as in diff_amount
+            calculated_amount=F("profile_ac__transactions_amount")
+            + Coalesce("profile_ac__initial_amount", Value(Decimal(0))),
+            diff_amount=F("profile_ac__diff_amount"),
+        )
+        queryset = self.filter_form.filter_queryset(queryset)
+        return queryset.order_by(*self.get_ordering())
+
+    def get_sort(self):
+        """Return the sort and tie-breaker lookups, and whether it is descending"""
+        sort = self.filter_form.is_valid() and self.filter_form.cleaned_data["sort"]
+        sort = sort or "diff_amount"
+        return (*self.sort_lookups[sort.lstrip("-")], sort.startswith("-"))
+
+    def paginate_queryset(self, queryset, page_size):
+        query = self.request.GET.urlencode()
+        users, self.next_query = cache.get_or_set(
+            f"user_list:{hashlib.sha1(query.encode()).hexdigest()}",
+            lambda: self.get_keyset_page(queryset, page_size),
+            self.cache_timeout,
+            version=self.data_generation,
+        )
+        return None, None, users, self.next_query is not None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.get_page_context(self.next_query))
+        context.update(
+            {
+                "filter_form": self.filter_form,
+                "data_generation": self.data_generation,
+                "cache_timeout": self.cache_timeout,
+            }
+        )
+        return context
+
+
+class Echo:
+    """File-like object returning what is written, to stream a CSV writer"""
+
+    def write(self, value):
+        return value
+
+
+class UserListExportView(UserListView):
+    """The reconciliation list, with its filters, as a streamed CSV or NDJSON file"""
+
+    # Exported value, and CSV header
+    columns = [
+        ("email", "Courriel"),
+        ("profile_ac__current_amount", "Montant actuel importé"),
+        ("calculated_amount", "Montant actuel calculé"),
+        ("diff_amount", "Différence"),
+        ("profile_ac__member_revo", "Adhérent Revolution'air"),
+        ("profile_ac__member_CS", "Membre Championnet Sports"),
+    ]
+    content_types = {
+        "csv": "text/csv; charset=utf-8",
+        "ndjson": "application/x-ndjson",
+    }
+    chunk_size = 2000
+
+    def get(self, request, *args, **kwargs):
+        self.filter_form = UserListFilterForm(request.GET)
+        export_format = request.GET.get("format", "csv")
+        if export_format not in self.content_types:
+            raise Http404(_("Unknown export format"))
+
+        lookups = [lookup for lookup, header in self.columns]
+        rows = map(
+            self.format_row,
+            self.get_queryset()
+            .values_list(*lookups)
+            .iterator(chunk_size=self.chunk_size),
+        )
+        if export_format == "csv":
+            content = self.stream_csv(rows)
+        else:
+            content = self.stream_ndjson(lookups, rows)
+
+        response = StreamingHttpResponse(
+            content, content_type=self.content_types[export_format]
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="rapprochement.{export_format}"'
+        return response
+
+    @staticmethod
+    def format_row(row):
+        # The amounts computed by the database come without their trailing
+        # zeros
+        return [
+            value.quantize(TWO_PLACES) if isinstance(value, Decimal) else value
+            for value in row
+        ]
+
+    def stream_csv(self, rows):
+        writer = csv.writer(Echo())
+        # The byte order mark lets spreadsheet softwares detect UTF-8
+        yield "\ufeff" + writer.writerow([header for lookup, header in self.columns])
+        for row in rows:
+            yield writer.writerow(row)
+
+    def stream_ndjson(self, lookups, rows):
+        keys = [lookup.removeprefix("profile_ac__") for lookup in lookups]
+        for row in rows:
+            yield json.dumps(dict(zip(keys, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+class BalanceView(View):
+    """Balance at the end of a day, of a user or of the whole club, as JSON"""
+
+    def get(self, request, *args, **kwargs):
+        form = BalanceAtDateForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors}, status=400)
+
+        day = form.cleaned_data["date"]
+        user = form.cleaned_data["user"]
+        user_id = user.pk if user else None
+        return JsonResponse(
+            {
+                "date": day,
+                "user": user_id,
+                "balance": MonthlyBalance.objects.balance_at(day, user_id=user_id),
+            }
+        )
+
+
+class BalanceHistoryView(TemplateView):
+    """Monthly balances of a user, or of the whole club without pk"""
+
+    template_name = "suivi_operations/balance_history.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        member = None
+        if "pk" in self.kwargs:
+            member = get_object_or_404(User, pk=self.kwargs["pk"])
+        context["member"] = member
+        context["history"] = MonthlyBalance.objects.history(
+            user_id=member.pk if member else None
         )
-        return queryset
+        return context
+
+
+class SendDebtMailView(KeysetPaginationMixin, SuccessMessageMixin, FormView):
+    """Queue a reminder for the selected debtors, sent by send_reminders.
 
+    The debtors are listed by page, the most indebted first, with the search
+    and thresholds of DebtorFilterForm. Either the debtors checked on the page
+    or all those matching the filters are reminded.
+    """
 
-class SendDebtMailView(SuccessMessageMixin, FormView):
     form_class = SelectDebtUserForm
     template_name = "suivi_operations/selectdebtuser.html"
     success_url = "#"
-    success_message = _("Send successfully")
+    success_message = _("%(queued)d reminder(s) queued, %(skipped)d already queued")
+    paginate_by = 100
+    cursor_salt = "debtor_list"
+
+    def dispatch(self, request, *args, **kwargs):
+        # The form is posted to the URL of the list, with its filters
+        self.filter_form = DebtorFilterForm(request.GET)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_initial(self):
+        if self.filter_form.is_valid():
+            return self.filter_form.cleaned_data
+        return {}
 
     def form_valid(self, form):
-        selected_users = form.cleaned_data["users"]
-        # if isinstance(selected_users, User):
-        #     selected_users = [selected_users]
-
-        for user in selected_users:
-            template = get_template("suivi_operations/emails/debt_message.html")
-            html_content = template.render(
-                {
-                    "user": user,
-                    "date_check": datetime.today(),
-                }
-            )
-            html_content = re.sub(r"\s*\n\s*", " ", html_content).strip()
-
-            email = EmailMessage(
-                subject="[important] Revolution'air - Dette à payer",
-                from_email="admin@revos.fr",
-                to=[user.email],
-                body=html_content,
-                reply_to=["tresorier@revos.fr"],
-            )
-            email.send()
-            print(user.email)
-            # print(html_content)
+        self.queued, self.skipped = Reminder.objects.queue(
+            form.recipients(), DEBT_SUBJECT
+        )
+        return super().form_valid(form)
 
+    def get_success_message(self, cleaned_data):
+        return self.success_message % {
+            "queued": self.queued,
+            "skipped": self.skipped,
+        }
+
+    def get_sort(self):
+        # The most indebted first, on the (current_amount, user) index
+        return "profile_ac__current_amount", "profile_ac__user", False
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        matching = self.filter_form.filter_queryset(DebtorFilterForm.debtors())
+        debtors, next_query = self.get_keyset_page(
+            matching.select_related("profile_ac"), self.paginate_by
+        )
+        context.update(self.get_page_context(next_query))
+        context.update(
+            {
+                "filter_form": self.filter_form,
+                "debtors": debtors,
+                "matching_count": matching.count(),
+            }
+        )
+        return context
+
+
+class ReminderCampaignView(SuccessMessageMixin, FormView):
+    """Remind every debtor over a threshold, previewed before being queued"""
+
+    form_class = ReminderCampaignForm
+    template_name = "suivi_operations/reminder_campaign.html"
+    success_url = "#"
+    success_message = _("%(queued)d reminder(s) queued, %(skipped)d already queued")
+    preview_size = 100
+
+    def form_valid(self, form):
+        recipients = Reminder.objects.campaign_recipients(**form.cleaned_data)
+        if "preview" in self.request.POST:
+            # Dry run, nothing is written
+            return self.render_to_response(
+                self.get_context_data(
+                    form=form,
+                    preview=recipients.aggregate(
+                        count=Count("pk"), total=Sum("profile_ac__current_amount")
+                    ),
+                    recipients=recipients.select_related("profile_ac").order_by(
+                        "profile_ac__current_amount", "profile_ac__user"
+                    )[: self.preview_size],
+                )
+            )
+        self.queued, self.skipped = Reminder.objects.queue(recipients, DEBT_SUBJECT)
         return super().form_valid(form)
+
+    def get_success_message(self, cleaned_data):
+        return self.success_message % {
+            "queued": self.queued,
+            "skipped": self.skipped,
+        }
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class RequestProfileListView(TemplateView):
+    template_name = "suivi_operations/request_profiles.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["profiles"] = history.slowest()
+        return context
@@ -0,0 +1,87 @@
+"""Micro-benchmark of the ledger value parsers.
+
+Compare the previous inline parsing (strptime and Decimal for every row) with
+suivi_operations.parsers on a synthetic ledger, and print rows per second:
+
+    python tools/bench_parsers.py [--rows 100000]
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from suivi_operations import parsers  # noqa: E402
+
+
+def synthetic_ledger(rows, seed=0):
+    """Ledger lines with the date and amount columns of an AssoConnect export"""
+    generator = random.Random(seed)
+    season_start = date(2022, 7, 1)
+    amounts = [
+        f"{euros:,}".replace(",", "\u202f") + f",{cents:02d}"
+        for euros in (5, 10, 12, 15, 20, 25, 40, 60, 85, 120, 150, 1012)
+        for cents in (0, 50)
+    ]
+    ledger = []
+    for _ in range(rows):
+        day = season_start + timedelta(days=generator.randrange(365))
+        amount = generator.choice(amounts)
+        credit = generator.random() < 0.3
+        ledger.append(
+            {
+                "Date": day.strftime("%d/%m/%Y"),
+                "Crédit (EUR)": amount if credit else "",
+                "Débit (EUR)": "" if credit else amount,
+            }
+        )
+    return ledger
+
+
+def previous_parser(line):
+    def amount_to_decimal(amount):
+        return round(Decimal(amount.replace(",", ".").replace("\u202f", "")), 2)
+
+    if line["Crédit (EUR)"]:
+        amount = amount_to_decimal(line["Crédit (EUR)"])
+    else:
+        amount = -1 * amount_to_decimal(line["Débit (EUR)"])
+    return amount, datetime.strptime(line["Date"], "%d/%m/%Y").date()
+
+
+def memoized_parser(line):
+    if line["Crédit (EUR)"]:
+        amount = parsers.parse_amount(line["Crédit (EUR)"])
+    else:
+        amount = -1 * parsers.parse_amount(line["Débit (EUR)"])
+    return amount, parsers.parse_day_first_date(line["Date"])
+
+
+def bench(parser, ledger):
+    start = time.perf_counter()
+    results = [parser(line) for line in ledger]
+    return len(ledger) / (time.perf_counter() - start), results
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument("--rows", type=int, default=100_000)
+    arguments = argument_parser.parse_args()
+
+    ledger = synthetic_ledger(arguments.rows)
+    before, expected = bench(previous_parser, ledger)
+    after, results = bench(memoized_parser, ledger)
+    if results != expected:
+        sys.exit("Parsers disagree on the synthetic ledger")
+
+    print(f"{arguments.rows} ledger lines")
+    print(f"before: {before:12,.0f} rows/s")
+    print(f"after:  {after:12,.0f} rows/s  (x{after / before:.1f})")
+
+
+if __name__ == "__main__":
+    main()